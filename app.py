@@ -1,13 +1,250 @@
+import time
+START_TIME = time.perf_counter()
+
+import sys
+if __name__ == "__main__":
+    # Headless batch processing needs no GUI imports at all
+    if sys.argv[1:2] == ["batch"]:
+        from batch import main as batch_main
+        sys.exit(batch_main(sys.argv[2:]))
+        
+    # Hand the image to a running Openpix before paying for the GUI imports
+    from instance import forward_arguments
+    if forward_arguments(sys.argv[1:]):
+        sys.exit(0)
+
+# Only what the first frame needs, module running and file handling are imported on first use
 import customtkinter as ctk
 import tkinter as tk
 from tkinter import filedialog, messagebox
 import os
-import sys
+import atexit
 import shutil
-import subprocess
 from PIL import Image, ImageTk
-import glob
-import re
+import threading
+import queue
+from collections import OrderedDict
+from history import EditHistory
+from tracing import span, begin, get_last, get_memory_usage
+
+# Viewer tiling configuration
+TILE_SIZE = 256
+TILE_CACHE_LIMIT = 512
+MIN_ZOOM = 0.1
+MAX_ZOOM = 10.0
+
+# Progressive rendering configuration
+PREVIEW_RESAMPLE = Image.Resampling.NEAREST
+FINAL_RESAMPLE = Image.Resampling.LANCZOS
+FRAME_DELAY = 16
+REFINE_DELAY = 250
+RENDER_POLL_DELAY = 10
+
+# Module list configuration
+MODULE_ROW_HEIGHT = 44
+MODULE_ROW_PADDING = 2
+MODULE_INDENT = 10
+
+# Delay between last keystroke and module search
+SEARCH_DELAY = 30
+
+# Modes the viewer renders without converting
+DISPLAY_MODES = ('L', 'RGB', 'RGBA')
+
+# Module job polling interval
+JOB_POLL_DELAY = 50
+
+# Polling interval for images sent by later invocations
+INSTANCE_POLL_DELAY = 100
+
+# Timing HUD drawn over the viewer
+HUD_FONT = ("Courier", 10)
+HUD_MARGIN = 8
+
+class TileCache:
+    """Least recently used cache of rendered viewer tiles"""
+    def __init__(self, limit=TILE_CACHE_LIMIT):
+        self.limit = limit
+        self.tiles = OrderedDict()
+        
+    def get(self, key):
+        """Return cached tile or None"""
+        tile = self.tiles.get(key)
+        if tile is not None:
+            self.tiles.move_to_end(key)
+        return tile
+        
+    def put(self, key, tile):
+        """Store tile and evict the least recently used ones"""
+        self.tiles[key] = tile
+        self.tiles.move_to_end(key)
+        while len(self.tiles) > self.limit:
+            self.tiles.popitem(last=False)
+            
+    def clear(self):
+        """Drop all cached tiles"""
+        self.tiles.clear()
+
+def get_display_size(image_size, scale):
+    """Get size of image drawn at given scale"""
+    return (max(1, int(round(image_size[0] * scale))),
+            max(1, int(round(image_size[1] * scale))))
+
+def get_visible_tiles(display_size, offset, canvas_size, tile_size=TILE_SIZE):
+    """Get (column, row) of every tile that intersects the canvas"""
+    display_width, display_height = display_size
+    offset_x, offset_y = offset
+    canvas_width, canvas_height = canvas_size
+    
+    # Visible part of the image in display coordinates
+    left = max(0, -offset_x)
+    top = max(0, -offset_y)
+    right = min(display_width, canvas_width - offset_x)
+    bottom = min(display_height, canvas_height - offset_y)
+    if right <= left or bottom <= top:
+        return []
+        
+    columns = range(int(left // tile_size), int((right - 1) // tile_size) + 1)
+    rows = range(int(top // tile_size), int((bottom - 1) // tile_size) + 1)
+    return [(column, row) for row in rows for column in columns]
+
+def render_tile(image, display_size, column, row, resample=Image.Resampling.LANCZOS, tile_size=TILE_SIZE):
+    """Resample the part of image covered by one display tile"""
+    display_width, display_height = display_size
+    x0 = column * tile_size
+    y0 = row * tile_size
+    x1 = min(x0 + tile_size, display_width)
+    y1 = min(y0 + tile_size, display_height)
+    
+    # Map tile rectangle back to source pixels
+    ratio_x = image.width / display_width
+    ratio_y = image.height / display_height
+    box = (x0 * ratio_x, y0 * ratio_y, x1 * ratio_x, y1 * ratio_y)
+    return image.resize((x1 - x0, y1 - y0), resample, box=box)
+
+def render_tiles(pyramid, scale, keys, final):
+    """Render tiles one by one, yielding (key, final, tile) as each is done"""
+    # Resample from the nearest pyramid level instead of full resolution
+    source = pyramid.get_source(scale)
+    resample = FINAL_RESAMPLE if final else PREVIEW_RESAMPLE
+    for key in keys:
+        display_size, column, row = key
+        with span("viewer.render_tile", column=column, row=row, final=final):
+            tile = render_tile(source, display_size, column, row, resample)
+        yield key, final, tile
+
+class RenderWorker:
+    """Background thread that resamples images off the Tk main thread
+    
+    Only the newest job is kept: submitting a job supersedes the previous
+    one, which stops at its next yielded result. Results are collected with
+    get_results from the Tk thread and tagged with their job generation.
+    """
+    def __init__(self):
+        self.condition = threading.Condition()
+        self.generation = 0
+        self.job = None
+        self.results = queue.Queue()
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+        
+    def submit(self, function, *args):
+        """Queue generator function, returns generation of the new job"""
+        with self.condition:
+            self.generation += 1
+            self.job = (self.generation, function, args)
+            self.condition.notify()
+            return self.generation
+            
+    def cancel(self):
+        """Supersede running and queued jobs without starting a new one"""
+        with self.condition:
+            self.generation += 1
+            self.job = None
+            
+    def get_results(self):
+        """Get all (generation, result) pairs available now, None marks a finished job"""
+        results = []
+        while True:
+            try:
+                results.append(self.results.get_nowait())
+            except queue.Empty:
+                return results
+                
+    def run(self):
+        """Worker loop"""
+        while True:
+            with self.condition:
+                while self.job is None:
+                    self.condition.wait()
+                generation, function, args = self.job
+                self.job = None
+                
+            try:
+                for result in function(*args):
+                    if generation != self.generation:
+                        break
+                    self.results.put((generation, result))
+            except Exception as e:
+                print(f"Error rendering: {e}")
+            self.results.put((generation, None))
+
+def get_display_image(image):
+    """Get copy of image in a mode that can be resampled smoothly and shown by Tk
+
+    Only the viewer converts; the edited image keeps its native mode.
+    """
+    if image.mode in DISPLAY_MODES:
+        return image
+    if image.mode == '1':
+        return image.convert('L')
+    if image.mode in ('P', 'PA', 'LA'):
+        # Palette images only resample with NEAREST, expand them
+        has_alpha = image.mode != 'P' or 'transparency' in image.info
+        return image.convert('RGBA' if has_alpha else 'RGB')
+    if image.mode.startswith('I;16'):
+        # Map 16-bit range to 8 bits instead of clipping
+        return image.convert('I').point(lambda value: value * (1 / 256)).convert('L')
+    if image.mode in ('I', 'F'):
+        return image.convert('L')
+    return image.convert('RGB')
+
+class ImagePyramid:
+    """Lazily built half-resolution levels (1/2, 1/4, 1/8 ...) of an image
+
+    Levels of a TiledImage stay tiled, and are only decoded where tiles are
+    drawn, until they are small enough to be held as a regular image.
+    """
+    def __init__(self, image):
+        self.image = image
+        self.levels = []
+        
+    def get_level(self, index):
+        """Get pyramid level, building missing levels from the previous one"""
+        if not self.levels:
+            # Converted on first use, so it happens on the render thread
+            with span("viewer.display_convert", mode=self.image.mode):
+                from tilestore import TiledImage
+                if not isinstance(self.image, TiledImage):
+                    self.levels.append(get_display_image(self.image))
+                elif self.image.mode in DISPLAY_MODES:
+                    self.levels.append(self.image)
+                else:
+                    self.levels.append(self.image.map(get_display_image))
+        while len(self.levels) <= index:
+            previous = self.levels[-1]
+            if previous.width < 2 or previous.height < 2:
+                return previous
+            with span("viewer.pyramid_level", level=len(self.levels)):
+                self.levels.append(previous.reduce(2))
+        return self.levels[index]
+        
+    def get_source(self, scale):
+        """Get the smallest level that still has at least the resolution needed for scale"""
+        index = 0
+        while scale * 2 ** (index + 1) <= 1.0:
+            index += 1
+        return self.get_level(index)
 
 class ImageViewer(ctk.CTkFrame):
     def __init__(self, master, **kwargs):
@@ -19,15 +256,32 @@ class ImageViewer(ctk.CTkFrame):
         
         # Image variables
         self.image = None
-        self.photo = None
-        self.canvas_image = None
+        self.pyramid = None
         self.zoom_factor = 1.0
         self.original_size = (0, 0)
         self.fit_to_window = True
         
+        # Tile variables
+        self.tile_cache = TileCache()
+        self.tile_items = {}
+        self.visible_keys = []
+        self.offset = (0, 0)
+        self.display_size = (0, 0)
+        
         # Update variables
         self.update_pending = False
         self.last_canvas_size = (0, 0)
+        self.interacting = False
+        self.refine_job = None
+        
+        # Background rendering
+        self.render_worker = RenderWorker()
+        self.render_generation = None
+        self.poll_job = None
+        
+        # Timing of the frame being rendered, and the HUD showing the last one
+        self.frame_span = None
+        self.hud_enabled = False
         
         # Bind events
         self.canvas.bind("<Button-1>", self.start_drag)
@@ -43,18 +297,34 @@ class ImageViewer(ctk.CTkFrame):
         
     def load_image(self, image_path):
         """Load and display image"""
+        from pixelbuffer import open_image
         try:
-            self.image = Image.open(image_path)
-            self.original_size = self.image.size
-            self.zoom_factor = 1.0
-            self.fit_to_window = True
-            self.schedule_update()
+            self.set_image(open_image(image_path))
         except Exception as e:
             messagebox.showerror("Error", f"Cannot load image: {str(e)}")
             
+    def set_image(self, image):
+        """Display in-memory image"""
+        self.image = image
+        self.pyramid = ImagePyramid(self.image)
+        self.original_size = self.image.size
+        self.zoom_factor = 1.0
+        self.fit_to_window = True
+        self.clear_tiles()
+        self.schedule_update()
+            
+    def clear_tiles(self):
+        """Remove tiles from canvas and cache"""
+        self.cancel_render()
+        self.canvas.delete("tile")
+        self.tile_items = {}
+        self.visible_keys = []
+        self.tile_cache.clear()
+        self.display_size = (0, 0)
+            
     def on_canvas_configure(self, event):
         """Handle canvas resize"""
-        if self.image and self.fit_to_window:
+        if self.image:
             current_size = (event.width, event.height)
             if current_size != self.last_canvas_size:
                 self.last_canvas_size = current_size
@@ -64,10 +334,51 @@ class ImageViewer(ctk.CTkFrame):
         """Schedule display update to avoid multiple rapid updates"""
         if not self.update_pending:
             self.update_pending = True
-            self.after(50, self.update_display)
+            self.after(FRAME_DELAY if self.interacting else 50, self.update_display)
+            
+    def begin_interaction(self):
+        """Switch to fast preview rendering until input goes quiet"""
+        self.interacting = True
+        
+        # Drop pending refine, new input restarts the quiet period
+        if self.refine_job:
+            self.after_cancel(self.refine_job)
+        self.refine_job = self.after(REFINE_DELAY, self.refine_display)
+        
+    def refine_display(self):
+        """Re-render with the high quality filter once input is quiet"""
+        self.refine_job = None
+        self.interacting = False
+        self.schedule_update()
+            
+    def get_scale(self, canvas_width, canvas_height):
+        """Get display scale for current zoom mode"""
+        if self.fit_to_window:
+            img_width, img_height = self.original_size
+            scale_x = canvas_width / img_width
+            scale_y = canvas_height / img_height
+            return min(scale_x, scale_y, 1.0)  # Don't upscale initially
+        return self.zoom_factor
+        
+    def set_scale(self, scale, anchor=None):
+        """Change display scale keeping anchor point in place"""
+        if anchor is None:
+            anchor = (self.canvas.winfo_width() / 2, self.canvas.winfo_height() / 2)
+            
+        # Relative to the pending scale, the canvas may not show it yet
+        ratio = scale / self.current_scale()
+        
+        # Keep the image point under the anchor fixed
+        self.offset = (
+            anchor[0] - (anchor[0] - self.offset[0]) * ratio,
+            anchor[1] - (anchor[1] - self.offset[1]) * ratio
+        )
+        self.zoom_factor = scale
+        self.fit_to_window = False
+        self.schedule_update()
             
     def update_display(self):
-        """Update image display with current zoom"""
+        """Update image display with tiles visible on canvas"""
         self.update_pending = False
         
         if not self.image:
@@ -81,53 +392,183 @@ class ImageViewer(ctk.CTkFrame):
             self.schedule_update()
             return
             
+        # Frame lasts until its last tile is on canvas, a newer frame supersedes it
+        self.frame_span = begin("viewer.frame")
+        layout_span = begin("viewer.update_display")
         try:
-            # Calculate display size
+            scale = self.get_scale(canvas_width, canvas_height)
+            display_size = get_display_size(self.original_size, scale)
+            
             if self.fit_to_window:
-                # Fit image to canvas
-                img_width, img_height = self.image.size
-                scale_x = canvas_width / img_width
-                scale_y = canvas_height / img_height
-                scale = min(scale_x, scale_y, 1.0)  # Don't upscale initially
+                # Center image on canvas
+                self.offset = (
+                    (canvas_width - display_size[0]) // 2,
+                    (canvas_height - display_size[1]) // 2
+                )
                 
-                display_width = max(1, int(img_width * scale))
-                display_height = max(1, int(img_height * scale))
-            else:
-                # Use zoom factor
-                display_width = max(1, int(self.original_size[0] * self.zoom_factor))
-                display_height = max(1, int(self.original_size[1] * self.zoom_factor))
+            if display_size != self.display_size:
+                # Tiles of previous scale stay underneath until the new ones cover the view
+                self.canvas.addtag_withtag("stale", "tile")
+                self.tile_items = {}
+                self.display_size = display_size
                 
-            # Limit maximum size to prevent memory issues
-            max_size = 4000
-            if display_width > max_size or display_height > max_size:
-                scale = min(max_size / display_width, max_size / display_height)
-                display_width = int(display_width * scale)
-                display_height = int(display_height * scale)
+            offset_x, offset_y = int(round(self.offset[0])), int(round(self.offset[1]))
+            visible = get_visible_tiles(display_size, (offset_x, offset_y), (canvas_width, canvas_height))
+            
+            # Draw tiles already rendered, queue the rest for the render worker
+            final = not self.interacting
+            shown = {}
+            missing = []
+            for column, row in visible:
+                key = (display_size, column, row)
+                x = offset_x + column * TILE_SIZE
+                y = offset_y + row * TILE_SIZE
                 
-            # Resize image
-            display_image = self.image.resize((display_width, display_height), Image.Resampling.LANCZOS)
-            self.photo = ImageTk.PhotoImage(display_image)
-            
-            # Clear canvas and display image
-            self.canvas.delete("all")
-            self.canvas_image = self.canvas.create_image(
-                canvas_width//2, canvas_height//2, 
-                anchor="center", image=self.photo
-            )
+                entry = self.tile_items.pop(key, None)
+                if entry and (entry[2] or not final):
+                    # Tile on canvas is good enough, just move it
+                    self.canvas.coords(entry[0], x, y)
+                    shown[key] = entry
+                    continue
+                    
+                photo, is_final = self.get_cached_tile(key, final)
+                if photo is None:
+                    # Keep preview tile on canvas until the refined one arrives
+                    if entry:
+                        self.canvas.coords(entry[0], x, y)
+                        shown[key] = entry
+                    missing.append(key)
+                    continue
+                    
+                if entry:
+                    # Replace preview tile with refined one
+                    self.canvas.delete(entry[0])
+                    
+                item = self.canvas.create_image(x, y, anchor="nw", image=photo, tags="tile")
+                shown[key] = (item, photo, is_final)
+                
+            # Remove tiles scrolled out of view
+            for entry in self.tile_items.values():
+                self.canvas.delete(entry[0])
+            self.tile_items = shown
+            self.visible_keys = [(display_size, column, row) for column, row in visible]
+            self.drop_stale_tiles()
+            
+            # Newer request supersedes tiles still being rendered
+            if missing:
+                self.render_generation = self.render_worker.submit(render_tiles, self.pyramid, scale, missing, final)
+                if not self.poll_job:
+                    self.poll_render_results()
+            else:
+                self.cancel_render()
+                self.frame_span.end()
             
         except Exception as e:
             print(f"Error updating display: {e}")
-            # Try with smaller image if resize fails
-            try:
-                smaller_image = self.image.resize((100, 100), Image.Resampling.LANCZOS)
-                self.photo = ImageTk.PhotoImage(smaller_image)
-                self.canvas.delete("all")
-                self.canvas_image = self.canvas.create_image(
-                    canvas_width//2, canvas_height//2, 
-                    anchor="center", image=self.photo
-                )
-            except:
-                pass
+        layout_span.end()
+        self.update_hud()
+        
+    def get_cached_tile(self, key, final):
+        """Get cached tile good enough for current mode, or (None, final)"""
+        photo = self.tile_cache.get(key + (True,))
+        if photo is not None:
+            return photo, True
+            
+        if not final:
+            photo = self.tile_cache.get(key + (False,))
+            if photo is not None:
+                return photo, False
+                
+        return None, final
+        
+    def poll_render_results(self):
+        """Place tiles finished by the render worker on the canvas"""
+        self.poll_job = None
+        if self.render_generation is None:
+            return
+            
+        finished = False
+        for generation, result in self.render_worker.get_results():
+            # Drop stale renders
+            if generation != self.render_generation:
+                continue
+            if result is None:
+                finished = True
+            else:
+                self.place_tile(*result)
+        self.drop_stale_tiles()
+                
+        if finished:
+            self.render_generation = None
+            self.frame_span.end()
+            self.update_hud()
+        else:
+            self.poll_job = self.after(RENDER_POLL_DELAY, self.poll_render_results)
+            
+    def place_tile(self, key, final, tile):
+        """Create PhotoImage for rendered tile and show it"""
+        with span("viewer.photo_image"):
+            photo = ImageTk.PhotoImage(tile)
+        self.tile_cache.put(key + (final,), photo)
+        
+        display_size, column, row = key
+        if display_size != self.display_size:
+            return
+            
+        entry = self.tile_items.get(key)
+        if entry:
+            if entry[2] or not final:
+                return
+            self.canvas.delete(entry[0])
+            
+        x = int(round(self.offset[0])) + column * TILE_SIZE
+        y = int(round(self.offset[1])) + row * TILE_SIZE
+        item = self.canvas.create_image(x, y, anchor="nw", image=photo, tags="tile")
+        self.tile_items[key] = (item, photo, final)
+        if self.hud_enabled:
+            self.canvas.tag_raise("hud")
+        
+    def drop_stale_tiles(self):
+        """Remove tiles of the previous scale once tiles of the current one cover the view"""
+        if all(key in self.tile_items for key in self.visible_keys):
+            self.canvas.delete("stale")
+            
+    def cancel_render(self):
+        """Supersede tiles still being rendered"""
+        self.render_worker.cancel()
+        self.render_generation = None
+        if self.poll_job:
+            self.after_cancel(self.poll_job)
+            self.poll_job = None
+            
+    def set_hud(self, enabled):
+        """Show or hide timing HUD"""
+        self.hud_enabled = enabled
+        self.update_hud()
+        
+    def update_hud(self):
+        """Draw last frame timing and memory use over the image"""
+        self.canvas.delete("hud")
+        if not self.hud_enabled:
+            return
+            
+        lines = []
+        for label, name in (("frame", "viewer.frame"), ("layout", "viewer.update_display"),
+                            ("tile", "viewer.render_tile"), ("photo", "viewer.photo_image")):
+            seconds = get_last(name)
+            lines.append(f"{label:<7}{seconds * 1000:8.1f} ms" if seconds is not None else f"{label:<7}{'-':>8}")
+        lines.append(f"{'tiles':<7}{len(self.tile_items):8d}")
+        memory = get_memory_usage()
+        if memory is not None:
+            lines.append(f"{'memory':<7}{memory / 2 ** 20:8.0f} MB")
+            
+        text = self.canvas.create_text(HUD_MARGIN * 2, HUD_MARGIN * 2, anchor="nw", text="\n".join(lines),
+                                       font=HUD_FONT, fill="white", tags="hud")
+        left, top, right, bottom = self.canvas.bbox(text)
+        background = self.canvas.create_rectangle(left - HUD_MARGIN, top - HUD_MARGIN, right + HUD_MARGIN,
+                                                  bottom + HUD_MARGIN, fill="black", outline="", tags="hud")
+        self.canvas.tag_lower(background, text)
+        self.canvas.tag_raise("hud")
         
     def start_drag(self, event):
         """Start dragging image"""
@@ -136,13 +577,20 @@ class ImageViewer(ctk.CTkFrame):
         
     def drag(self, event):
         """Drag image"""
-        if self.canvas_image:
+        if self.image:
             dx = event.x - self.start_x
             dy = event.y - self.start_y
-            self.canvas.move(self.canvas_image, dx, dy)
+            self.begin_interaction()
+            self.canvas.move("tile", dx, dy)
+            self.offset = (self.offset[0] + dx, self.offset[1] + dy)
+            self.zoom_factor = self.current_scale()
+            self.fit_to_window = False
             self.start_x = event.x
             self.start_y = event.y
             
+            # Fill in tiles uncovered by dragging
+            self.schedule_update()
+            
     def zoom(self, event):
         """Zoom image"""
         if not self.image:
@@ -153,21 +601,22 @@ class ImageViewer(ctk.CTkFrame):
         canvas_y = self.canvas.canvasy(event.y)
         
         # Store old zoom factor
-        old_zoom = self.zoom_factor
+        old_zoom = self.current_scale()
+        zoom_factor = old_zoom
         
         # Determine zoom direction
         if event.delta > 0 or event.num == 4:  # Zoom in
-            self.zoom_factor *= 1.2
+            zoom_factor *= 1.2
         elif event.delta < 0 or event.num == 5:  # Zoom out
-            self.zoom_factor /= 1.2
+            zoom_factor /= 1.2
             
         # Limit zoom
-        self.zoom_factor = max(0.1, min(self.zoom_factor, 10.0))
+        zoom_factor = max(MIN_ZOOM, min(zoom_factor, MAX_ZOOM))
         
         # Disable fit to window when zooming
-        if self.zoom_factor != old_zoom:
-            self.fit_to_window = False
-            self.schedule_update()
+        if zoom_factor != old_zoom:
+            self.begin_interaction()
+            self.set_scale(zoom_factor, (canvas_x, canvas_y))
             
     def fit_image(self):
         """Fit image to window"""
@@ -179,56 +628,286 @@ class ImageViewer(ctk.CTkFrame):
     def zoom_in(self):
         """Zoom in programmatically"""
         if self.image:
-            self.zoom_factor *= 1.2
-            self.zoom_factor = min(self.zoom_factor, 10.0)
-            self.fit_to_window = False
-            self.schedule_update()
+            self.set_scale(min(self.current_scale() * 1.2, MAX_ZOOM))
             
     def zoom_out(self):
         """Zoom out programmatically"""
         if self.image:
-            self.zoom_factor /= 1.2
-            self.zoom_factor = max(self.zoom_factor, 0.1)
-            self.fit_to_window = False
-            self.schedule_update()
+            self.set_scale(max(self.current_scale() / 1.2, MIN_ZOOM))
+            
+    def current_scale(self):
+        """Get scale the image is shown at, including zoom steps not drawn yet"""
+        if self.fit_to_window and self.display_size[0]:
+            return self.display_size[0] / self.original_size[0]
+        return self.zoom_factor
             
     def actual_size(self):
         """Show image at actual size"""
         if self.image:
-            self.zoom_factor = 1.0
-            self.fit_to_window = False
-            self.schedule_update()
+            self.set_scale(1.0)
+
+def decode_image(image_path, preview=None):
+    """Decode image file for editing, large tiled files and pixel buffers only on demand"""
+    from tilestore import TiledImage, open_tiled
+    if isinstance(preview, TiledImage):
+        # Already opened lazily for the preview
+        return preview
+    with span("load.decode", path=image_path):
+        image = open_tiled(image_path)
+        if image:
+            return image
+        with Image.open(image_path) as img:
+            img.load()
+            # Keep native mode, modules and the viewer convert when they need to
+            return img
+        
+def decode_preview(image_path, size):
+    """Get image to show while the full image decodes, None if not possible
+
+    Files that open lazily are their own preview, the viewer reads the
+    reduced pyramid levels it needs. JPEGs are decoded reduced, at least
+    size large, using DCT scaling.
+    """
+    from tilestore import open_tiled
+    tiled = open_tiled(image_path)
+    if tiled:
+        return tiled
+    try:
+        img = Image.open(image_path)
+    except Image.DecompressionBombError:
+        # Too large to decode in full, decode_image reports it
+        return None
+    with img:
+        if img.format != 'JPEG':
+            return None
+        full_size = img.size
+        img.draft(img.mode, size)
+        if img.size == full_size:
+            # No reduction possible, the full decode is just as fast
+            return None
+        img.load()
+        return img
 
 class ModuleButton(ctk.CTkButton):
-    def __init__(self, master, module_path, display_name, icon_path, callback, **kwargs):
-        super().__init__(master, text=display_name, command=lambda: callback(module_path), **kwargs)
+    def __init__(self, master, module_path, display_name, icon, callback, **kwargs):
+        super().__init__(master, text=display_name, command=self.on_click, **kwargs)
+        self.callback = callback
+        self.set_module(module_path, display_name, icon)
+        
+    def set_module(self, module_path, display_name, icon):
+        """Show another module, buttons are recycled while the module list scrolls"""
         self.module_path = module_path
         self.display_name = display_name
         
-        # Try to load icon
-        try:
-            if os.path.exists(icon_path):
-                icon_image = Image.open(icon_path)
-                icon_image = icon_image.resize((24, 24), Image.Resampling.LANCZOS)
+        # Modules without a cached icon get a "?" marker
+        self.icon = icon
+        if self.icon:
+            self.configure(text=display_name, image=self.icon, compound="left", require_redraw=True)
+        else:
+            self.configure(text=f"? {display_name}", image=None, require_redraw=True)
+            
+    def on_click(self):
+        """Run module shown by button"""
+        self.callback(self.module_path)
+
+class ModuleListView(ctk.CTkFrame):
+    """Scrollable module tree that only creates widgets for rows in view
+
+    All rows have the same height, so the rows in view follow from the
+    scroll position. Widgets of rows scrolled out of view are reused for
+    the rows scrolled in.
+    """
+    def __init__(self, master, callback, **kwargs):
+        super().__init__(master, **kwargs)
+        self.callback = callback
+        
+        # Icons come from the atlas, CTkImages are made once per icon
+        self.icon_atlas = None
+        self.icons = {}
+        
+        # Canvas holding the row widgets, scrolled by the scrollbar
+        self.canvas = tk.Canvas(self, highlightthickness=0, yscrollincrement=MODULE_ROW_HEIGHT // 2,
+                                bg=self._apply_appearance_mode(self.cget("fg_color")))
+        self.scrollbar = ctk.CTkScrollbar(self, command=self.on_scrollbar)
+        self.canvas.configure(yscrollcommand=self.scrollbar.set)
+        self.scrollbar.pack(side="right", fill="y")
+        self.canvas.pack(side="left", fill="both", expand=True)
+        
+        # Row model
+        self.tree = None
+        self.filtered = None
+        self.collapsed = set()
+        self.rows = []
+        
+        # Row index -> (kind, widget, canvas item) of rows in view, unused widgets by kind
+        self.visible_rows = {}
+        self.free_widgets = {'group': [], 'module': []}
+        
+        # Bind events
+        self.canvas.bind("<Configure>", self.on_canvas_configure)
+        self.bind_all("<MouseWheel>", self.on_mouse_wheel, add="+")
+        self.bind_all("<Button-4>", self.on_mouse_wheel, add="+")  # Linux
+        self.bind_all("<Button-5>", self.on_mouse_wheel, add="+")  # Linux
+        
+    def set_tree(self, tree, icon_atlas):
+        """Show module tree with icons from icon_atlas"""
+        self.tree = tree
+        self.icon_atlas = icon_atlas
+        self.icons = {}
+        self.update_rows()
+        
+    def set_filter(self, modules):
+        """Show only modules as a flat list, or the whole tree again for None"""
+        self.filtered = modules
+        self.canvas.yview_moveto(0)
+        self.update_rows()
+        
+    def toggle_group(self, group_path):
+        """Expand or collapse group"""
+        if group_path in self.collapsed:
+            self.collapsed.remove(group_path)
+        else:
+            self.collapsed.add(group_path)
+        self.update_rows()
+        
+    def update_rows(self):
+        """Rebuild flat row list from tree, filter and collapsed groups"""
+        rows = []
+        if self.filtered is not None:
+            rows = [{'kind': 'module', 'node': module, 'level': 0} for module in self.filtered]
+        elif self.tree:
+            self.add_group_rows(rows, self.tree, 0)
+        self.rows = rows
+        
+        # Rows changed, reassign all widgets
+        for index in list(self.visible_rows):
+            self.release_row(index)
+        self.canvas.configure(scrollregion=(0, 0, 1, len(rows) * MODULE_ROW_HEIGHT))
+        self.update_visible_rows()
+        
+    def add_group_rows(self, rows, node, level):
+        """Append rows for sub-groups and modules of tree node, skipping collapsed content"""
+        for group in node['groups']:
+            rows.append({'kind': 'group', 'node': group, 'level': level})
+            if group['path'] not in self.collapsed:
+                self.add_group_rows(rows, group, level + 1)
+        for module in node['modules']:
+            rows.append({'kind': 'module', 'node': module, 'level': level})
+            
+    def update_visible_rows(self):
+        """Place widgets for rows in view and recycle the others"""
+        top = self.canvas.canvasy(0)
+        height = self.canvas.winfo_height()
+        first = max(0, int(top // MODULE_ROW_HEIGHT))
+        last = min(len(self.rows), int((top + height) // MODULE_ROW_HEIGHT) + 1)
+        
+        for index in list(self.visible_rows):
+            if not first <= index < last:
+                self.release_row(index)
                 
-                # Handle transparency properly
-                if icon_image.mode in ('RGBA', 'LA') or 'transparency' in icon_image.info:
-                    # Convert to RGBA if not already
-                    if icon_image.mode != 'RGBA':
-                        icon_image = icon_image.convert('RGBA')
-                    self.icon = ctk.CTkImage(icon_image, size=(24, 24))
-                else:
-                    self.icon = ctk.CTkImage(icon_image, size=(24, 24))
-                    
-                self.configure(image=self.icon, compound="left")
+        width = self.canvas.winfo_width()
+        for index in range(first, last):
+            if index in self.visible_rows:
+                continue
+            row = self.rows[index]
+            widget = self.get_row_widget(row)
+            indent = row['level'] * MODULE_INDENT
+            item = self.canvas.create_window(indent, index * MODULE_ROW_HEIGHT + MODULE_ROW_PADDING,
+                                             window=widget, anchor="nw", width=max(1, width - indent))
+            self.visible_rows[index] = (row['kind'], widget, item)
+            
+    def get_row_widget(self, row):
+        """Get unused widget for row, creating one if none is free"""
+        kind = row['kind']
+        node = row['node']
+        widget = self.free_widgets[kind].pop() if self.free_widgets[kind] else None
+        
+        if kind == 'group':
+            text = f"📁 {node['name']}"
+            command = lambda path=node['path']: self.toggle_group(path)
+            if widget is None:
+                widget = ctk.CTkButton(self.canvas, text=text, command=command, height=30)
             else:
-                self.configure(text=f"? {display_name}")
-        except Exception:
-            self.configure(text=f"? {display_name}")
+                widget.configure(text=text, command=command)
+        else:
+            icon = self.get_icon(node['icon_path'])
+            if widget is None:
+                widget = ModuleButton(self.canvas, node['path'], node['name'], icon, self.callback, height=40)
+            else:
+                widget.set_module(node['path'], node['name'], icon)
+        return widget
+        
+    def get_icon(self, icon_path):
+        """Get button image for icon from the atlas, None if there is none"""
+        if not icon_path:
+            return None
+        if icon_path not in self.icons:
+            icon_image = self.icon_atlas.get(icon_path)
+            self.icons[icon_path] = ctk.CTkImage(icon_image, size=icon_image.size) if icon_image else None
+        return self.icons[icon_path]
+        
+    def release_row(self, index):
+        """Take widget of row off the canvas and keep it for reuse"""
+        kind, widget, item = self.visible_rows.pop(index)
+        self.canvas.delete(item)
+        self.free_widgets[kind].append(widget)
+        
+    def on_canvas_configure(self, event):
+        """Resize rows to canvas width and fill newly exposed space"""
+        for kind, widget, item in self.visible_rows.values():
+            x = self.canvas.coords(item)[0]
+            self.canvas.itemconfigure(item, width=max(1, event.width - int(x)))
+        self.update_visible_rows()
+        
+    def on_scrollbar(self, *args):
+        """Scroll by scrollbar"""
+        self.canvas.yview(*args)
+        self.update_visible_rows()
+        
+    def on_mouse_wheel(self, event):
+        """Scroll by mouse wheel over the list"""
+        if not str(event.widget).startswith(str(self.canvas)):
+            return
+        if getattr(event, "num", None) == 4:
+            delta = -2
+        elif getattr(event, "num", None) == 5:
+            delta = 2
+        else:
+            delta = -2 if event.delta > 0 else 2
+        self.canvas.yview_scroll(delta, "units")
+        self.update_visible_rows()
+        return "break"
+
+class StartupTimer:
+    """Durations of startup stages, printed as a report once startup is done"""
+    def __init__(self, start):
+        self.start = start
+        self.last = start
+        self.stages = []
+        
+    def mark(self, stage):
+        """End stage that ran since the previous mark"""
+        now = time.perf_counter()
+        self.stages.append((stage, now - self.last))
+        self.last = now
+        
+    def add(self, stage, seconds):
+        """Record stage that ran elsewhere, e.g. on a background thread"""
+        self.stages.append((stage, seconds))
+        
+    def report(self):
+        """Print time spent per stage and in total"""
+        total = time.perf_counter() - self.start
+        print("Startup timing:")
+        for stage, seconds in self.stages:
+            print(f"  {stage:<28} {seconds * 1000:8.1f} ms")
+        print(f"  {'total':<28} {total * 1000:8.1f} ms")
 
 class OpenpixApp(ctk.CTk):
-    def __init__(self):
+    def __init__(self, image_path=None, single_instance=True, show_hud=False):
         super().__init__()
+        self.startup_timer = StartupTimer(START_TIME)
+        self.startup_timer.mark("imports and Tk root")
         
         # App configuration
         self.title("Openpix - Image Editor")
@@ -236,32 +915,120 @@ class OpenpixApp(ctk.CTk):
         self.minsize(800, 600)  # Set minimum window size
         
         # Initialize variables
-        self.current_image_path = None
+        self.current_image = None
         self.original_file_path = None  # Store original file path
-        self.temp_dir = "temp"
+        self.temp_root = "temp"
         self.modules_dir = "modules"
         self.icons_dir = "icons"
-        self.current_image_index = 0
-        self.max_image_index = 0
         
         # Check required directories
         self.check_directories()
         
-        # Clear temp directory
-        self.clear_temp_directory()
+        # Hand-off files and spilled history of this window, other windows have their own
+        from instance import create_session_dir
+        self.temp_dir = create_session_dir(self.temp_root)
+        atexit.register(shutil.rmtree, self.temp_dir, ignore_errors=True)
+        self.history = EditHistory(self.temp_dir)
+        
+        self.initial_image_path = image_path
+        
+        # Module tree and resized icons cached between runs, created when modules are scanned
+        self.module_index = None
+        self.icon_atlas = None
+        self.modules_job = None
+        
+        # Warm worker processes for script modules, started after the window shows
+        self.module_pool = None
+        self.module_task = None
+        self.stage_lock = threading.Lock()
+        self.open_job = None
+        self.load_span = None
         
         # Create UI
         self.create_ui()
+        self.image_viewer.set_hud(show_hud)
+        self.bind("<F3>", self.toggle_hud)
+        self.startup_timer.mark("window")
+        
+        # Later invocations hand their image to this window
+        self.instance_server = None
+        if single_instance:
+            from instance import InstanceServer
+            self.instance_server = InstanceServer()
+            if self.instance_server.start():
+                self.poll_instance_requests()
+            else:
+                self.instance_server = None
+        
+        # Everything else runs once the window is up
+        self.after_idle(self.start_deferred)
         
+    def start_deferred(self):
+        """First startup stage after the window is shown"""
+        self.startup_timer.mark("first paint")
+        
+        # Remove temp directories left behind by windows that did not exit cleanly
+        self.clear_temp_directory()
+        self.startup_timer.mark("temp cleanup")
+        
+        # Scan modules in the background, the panel fills in when done
+        from workers import ThreadJob
+        self.modules_job = ThreadJob(self.scan_modules)
+        self.poll_job(self.modules_job, self.finish_modules_job)
+        self.after_idle(self.start_module_pool)
+        
+    def start_module_pool(self):
+        """Startup stage: start warm worker processes, then open the initial image"""
+        from workers import ModuleWorkerPool
+        self.module_pool = ModuleWorkerPool()
+        self.startup_timer.mark("module workers")
+        self.after_idle(self.open_initial_image)
+        
+    def open_initial_image(self):
+        """Startup stage: load image given on the command line or ask for one"""
         # Load initial image if provided
-        if len(sys.argv) > 1:
-            self.load_image(sys.argv[1])
+        if self.initial_image_path:
+            self.load_image(self.initial_image_path)
+            self.startup_timer.mark("image preview")
         else:
             self.show_open_dialog()
             
+    def poll_instance_requests(self):
+        """Open images sent by later invocations"""
+        for image_path in self.instance_server.get_requests():
+            # Bring window to front
+            self.deiconify()
+            self.lift()
+            self.focus_force()
+            if image_path:
+                self.load_image(image_path)
+        self.after(INSTANCE_POLL_DELAY, self.poll_instance_requests)
+        
+    def poll_job(self, job, callback):
+        """Call callback with background job on the Tk thread once it is done, unless cancelled"""
+        if job.cancelled:
+            return
+        if not job.done:
+            self.after(JOB_POLL_DELAY, self.poll_job, job, callback)
+            return
+        callback(job)
+        
+    def finish_modules_job(self, job):
+        """Fill module panel once the background scan is done"""
+        self.modules_job = None
+        if job.error:
+            messagebox.showerror("Error", f"Cannot load modules: {str(job.error)}")
+            print(f"Error loading modules: {str(job.error)}")
+            return
+            
+        self.startup_timer.add("module scan (background)", job.value[2])
+        self.show_modules(*job.value[:2])
+        self.startup_timer.mark("module panel")
+        self.startup_timer.report()
+        
     def check_directories(self):
         """Check if required directories exist"""
-        required_dirs = [self.temp_dir, self.modules_dir, self.icons_dir]
+        required_dirs = [self.temp_root, self.modules_dir, self.icons_dir]
         missing_dirs = [d for d in required_dirs if not os.path.exists(d)]
         
         if missing_dirs:
@@ -273,21 +1040,21 @@ class OpenpixApp(ctk.CTk):
             sys.exit(1)
             
     def clear_temp_directory(self):
-        """Clear temp directory"""
-        if os.path.exists(self.temp_dir):
-            for file in os.listdir(self.temp_dir):
-                file_path = os.path.join(self.temp_dir, file)
-                try:
-                    if os.path.isfile(file_path):
-                        os.unlink(file_path)
-                except Exception as e:
-                    print(f"Error deleting {file_path}: {e}")
+        """Remove session directories of Openpix processes that are no longer running"""
+        from instance import remove_stale_session_dirs
+        try:
+            remove_stale_session_dirs(self.temp_root)
+        except OSError as e:
+            print(f"Error cleaning {self.temp_root}: {e}")
                     
     def create_ui(self):
         """Create user interface"""
         # Create menu bar
         self.create_menu_bar()
         
+        # Create status bar
+        self.create_status_bar()
+        
         # Create main layout
         self.main_frame = ctk.CTkFrame(self)
         self.main_frame.pack(fill="both", expand=True, padx=10, pady=10)
@@ -320,15 +1087,26 @@ class OpenpixApp(ctk.CTk):
         self.clear_search_btn = ctk.CTkButton(self.search_frame, text="Clear", command=self.clear_search, width=60)
         self.clear_search_btn.pack(side="right", padx=5, pady=5)
         
-        # Modules scrollable frame
-        self.modules_scrollable = ctk.CTkScrollableFrame(self.right_frame)
-        self.modules_scrollable.pack(fill="both", expand=True, padx=10, pady=(0, 10))
+        # Modules list, only rows in view get widgets
+        self.module_list = ModuleListView(self.right_frame, self.run_module)
+        self.module_list.pack(fill="both", expand=True, padx=10, pady=(0, 10))
         
-        # Store all modules for filtering
-        self.all_modules = []
+        # Search index over all modules, rebuilt with the module list
+        self.module_search = None
+        self.search_job = None
         
-        # Load modules
-        self.load_modules()
+        # Modules are loaded in the background once the window shows
+        
+    def create_status_bar(self):
+        """Create status bar showing module progress"""
+        self.status_frame = ctk.CTkFrame(self)
+        self.status_frame.pack(side="bottom", fill="x", padx=10, pady=(0, 10))
+        
+        self.status_label = ctk.CTkLabel(self.status_frame, text="Ready", anchor="w")
+        self.status_label.pack(side="left", fill="x", expand=True, padx=10)
+        
+        self.cancel_btn = ctk.CTkButton(self.status_frame, text="Cancel", command=self.cancel_module, width=80, state="disabled")
+        self.cancel_btn.pack(side="right", padx=5, pady=5)
         
     def create_menu_bar(self):
         """Create menu bar"""
@@ -360,6 +1138,13 @@ class OpenpixApp(ctk.CTk):
         self.redo_btn = ctk.CTkButton(self.menu_scroll, text="Redo", command=self.redo, width=80)
         self.redo_btn.pack(side="left", padx=2, pady=5)
         
+        # Macro operations
+        self.save_macro_btn = ctk.CTkButton(self.menu_scroll, text="Save Macro", command=self.save_macro, width=80)
+        self.save_macro_btn.pack(side="left", padx=2, pady=5)
+        
+        self.play_macro_btn = ctk.CTkButton(self.menu_scroll, text="Play Macro", command=self.play_macro, width=80)
+        self.play_macro_btn.pack(side="left", padx=2, pady=5)
+        
         # Separator
         separator2 = ctk.CTkLabel(self.menu_scroll, text="|", width=20)
         separator2.pack(side="left", padx=5, pady=5)
@@ -384,144 +1169,78 @@ class OpenpixApp(ctk.CTk):
         
     def load_modules(self):
         """Load modules from modules directory"""
-        self.all_modules = []
-        self.scan_modules_directory(self.modules_dir, self.modules_scrollable)
-        
-    def scan_modules_directory(self, directory, parent_frame, level=0):
-        """Recursively scan modules directory"""
-        items = []
-        
-        # Get all items in directory
-        if os.path.exists(directory):
-            for item in os.listdir(directory):
-                item_path = os.path.join(directory, item)
-                if os.path.isdir(item_path):
-                    # Check if directory has .py files
-                    if self.has_python_files(item_path):
-                        items.append(("dir", item, item_path))
-                elif item.endswith(".py"):
-                    items.append(("file", item, item_path))
-                    
-        # Sort items
-        items.sort(key=lambda x: (x[0] == "file", x[1]))
-        
-        # Create UI elements
-        for item_type, item_name, item_path in items:
-            if item_type == "dir":
-                # Create collapsible section for directory
-                self.create_module_group(parent_frame, item_name, item_path, level)
-            else:
-                # Create button for module
-                module_info = self.create_module_button(parent_frame, item_name, item_path, level)
-                if module_info:
-                    self.all_modules.append(module_info)
-                    
-    def has_python_files(self, directory):
-        """Check if directory has Python files recursively"""
-        for root, dirs, files in os.walk(directory):
-            for file in files:
-                if file.endswith(".py"):
-                    return True
-        return False
-        
-    def create_module_group(self, parent_frame, group_name, group_path, level):
-        """Create a collapsible group for modules"""
-        # Group frame
-        group_frame = ctk.CTkFrame(parent_frame)
-        group_frame.pack(fill="x", pady=2, padx=level*10)
-        
-        # Group header
-        header_frame = ctk.CTkFrame(group_frame)
-        header_frame.pack(fill="x", padx=5, pady=2)
-        
-        # Group icon and name
-        icon_path = os.path.join(self.icons_dir, f"{group_name}.png")
-        group_btn = ctk.CTkButton(
-            header_frame, 
-            text=f"📁 {group_name}", 
-            command=lambda: self.toggle_group(content_frame),
-            height=30
-        )
-        group_btn.pack(side="left", fill="x", expand=True)
-        
-        # Content frame (collapsible)
-        content_frame = ctk.CTkFrame(group_frame)
-        content_frame.pack(fill="x", padx=5, pady=2)
-        
-        # Scan subdirectory
-        self.scan_modules_directory(group_path, content_frame, level + 1)
-        
-    def create_module_button(self, parent_frame, module_name, module_path, level):
-        """Create button for individual module"""
-        # Clean display name
-        display_name = module_name.replace(".py", "").replace("-", " ")
-        
-        # Icon path
-        icon_path = os.path.join(self.icons_dir, f"{module_name}.png")
-        
-        # Create button
-        btn = ModuleButton(
-            parent_frame,
-            module_path,
-            display_name,
-            icon_path,
-            self.run_module,
-            height=40
-        )
-        btn.pack(fill="x", pady=2, padx=level*10)
-        
-        # Return module info for search
-        return {
-            'button': btn,
-            'name': display_name.lower(),
-            'path': module_path,
-            'frame': parent_frame
-        }
+        tree, search, seconds = self.scan_modules()
+        self.show_modules(tree, search)
         
-    def toggle_group(self, content_frame):
-        """Toggle visibility of group content"""
-        if content_frame.winfo_viewable():
-            content_frame.pack_forget()
-        else:
-            content_frame.pack(fill="x", padx=5, pady=2)
+    def scan_modules(self):
+        """Update module index, search index and icon atlas, returns (tree, search index, seconds)
+
+        Touches no widgets, so it can run on a background thread.
+        """
+        start = time.perf_counter()
+        from module_index import ModuleIndex, iter_modules
+        from module_search import ModuleSearchIndex
+        from icon_atlas import IconAtlas
+        
+        if self.module_index is None:
+            self.module_index = ModuleIndex(self.modules_dir, self.icons_dir)
+            self.icon_atlas = IconAtlas()
+            
+        # Only directories changed since the last run are rescanned
+        tree = self.module_index.scan()
+        search = ModuleSearchIndex(iter_modules(tree))
+        
+        # Decode only icons that are new or changed since the atlas was written
+        self.icon_atlas.update({module['icon_path']: module['icon_mtime']
+                                for module, groups in iter_modules(tree) if module['icon_path']})
+        return tree, search, time.perf_counter() - start
+        
+    def show_modules(self, tree, search):
+        """Show scanned module tree in the module panel"""
+        self.module_search = search
+        self.module_list.set_tree(tree, self.icon_atlas)
+        
+        # Search typed while modules were loading
+        search_text = self.search_entry.get().lower().strip()
+        if search_text:
+            self.filter_modules(search_text)
             
     def on_search_change(self, event=None):
-        """Handle search input change"""
+        """Handle search input change, searching once typing pauses"""
+        if self.search_job:
+            self.after_cancel(self.search_job)
+        self.search_job = self.after(SEARCH_DELAY, self.run_search)
+        
+    def run_search(self):
+        """Filter modules by current search text"""
+        self.search_job = None
         search_text = self.search_entry.get().lower().strip()
         self.filter_modules(search_text)
         
     def clear_search(self):
         """Clear search and show all modules"""
+        if self.search_job:
+            self.after_cancel(self.search_job)
+            self.search_job = None
         self.search_entry.delete(0, 'end')
         self.filter_modules("")
         
     def filter_modules(self, search_text):
         """Filter modules based on search text"""
+        if self.module_search is None:
+            # Modules still loading, the search is applied when they are shown
+            return
         if not search_text:
             # Show all modules
-            for module_info in self.all_modules:
-                module_info['button'].pack(fill="x", pady=2, padx=0)
+            self.module_list.set_filter(None)
         else:
-            # Hide non-matching modules
-            for module_info in self.all_modules:
-                if search_text in module_info['name']:
-                    module_info['button'].pack(fill="x", pady=2, padx=0)
-                else:
-                    module_info['button'].pack_forget()
-                    
+            # Show matching modules only, best match first
+            self.module_list.set_filter(self.module_search.search(search_text))
+            
     def refresh_modules(self):
         """Refresh module list"""
-        # Clear existing modules
-        for widget in self.modules_scrollable.winfo_children():
-            widget.destroy()
-        
-        # Reload modules
+        # Reload modules, current search filter is applied again
         self.load_modules()
-        
-        # Apply current search filter
-        search_text = self.search_entry.get().lower().strip()
-        if search_text:
-            self.filter_modules(search_text)
             
     def show_open_dialog(self):
         """Show file open dialog"""
@@ -537,112 +1256,371 @@ class OpenpixApp(ctk.CTk):
             
     def load_image(self, image_path):
         """Load image into application"""
+        from workers import ThreadJob
+        
+        # Result of a running module belongs to the previous image
+        self.cancel_module()
+        
         try:
             # Store original file path
             self.original_file_path = image_path
             
-            # Convert and save as PNG to temp directory
-            temp_path = os.path.join(self.temp_dir, "image0.png")
+            # Previous image is no longer editable
+            if self.open_job:
+                self.open_job.cancel()
+            self.current_image = None
+            self.history.clear()
             
-            # Open image and convert to PNG
-            with Image.open(image_path) as img:
-                # Convert to RGB if necessary (for JPEG compatibility)
-                if img.mode in ('RGBA', 'LA'):
-                    # Keep transparency for PNG
-                    img.save(temp_path, 'PNG')
-                else:
-                    # Convert to RGB for other formats
-                    img.convert('RGB').save(temp_path, 'PNG')
-            
-            # Update current image
-            self.current_image_path = temp_path
-            self.current_image_index = 0
-            self.max_image_index = 0
+            # Whole load until the full resolution image is current
+            self.load_span = begin("load.total", path=image_path)
             
-            # Load in viewer
-            self.image_viewer.load_image(temp_path)
+            # Show reduced preview at once, decode full resolution in the background
+            with span("load.preview"):
+                preview = decode_preview(image_path, (self.winfo_screenwidth(), self.winfo_screenheight()))
+            if preview:
+                self.image_viewer.set_image(preview)
+                
+            self.open_job = ThreadJob(decode_image, image_path, preview)
+            self.set_status(f"Loading {os.path.basename(image_path)}...")
+            self.poll_job(self.open_job, self.finish_open_job)
             
         except Exception as e:
             messagebox.showerror("Error", f"Cannot load image: {str(e)}")
             
-    def get_current_image_path(self):
-        """Get current image path"""
-        if not self.current_image_path:
-            return None
-        return os.path.join(self.temp_dir, f"image{self.current_image_index}.png")
+    def finish_open_job(self, job):
+        """Show full resolution image once decoded"""
+        self.open_job = None
+        self.set_status("Ready")
+        if job.error:
+            messagebox.showerror("Error", f"Cannot load image: {str(job.error)}")
+            return
+            
+        # Start new history, written to temp directory only when a module needs a file
+        with span("load.history_reset"):
+            self.history.reset(job.value)
         
-    def run_module(self, module_path):
-        """Run a module on current image"""
-        current_path = self.get_current_image_path()
-        if not current_path or not os.path.exists(current_path):
+        # Load in viewer
+        self.set_current_image(job.value)
+        self.load_span.end()
+            
+    def set_current_image(self, image):
+        """Make in-memory image current and display it"""
+        self.current_image = image
+        if image is not self.image_viewer.image:
+            self.image_viewer.set_image(image)
+        
+    def can_start_module(self):
+        """Check a module can run now, warning the user if not"""
+        if self.module_pool is None:
+            messagebox.showwarning("Warning", "Openpix is still starting")
+            return False
+            
+        if self.open_job:
+            messagebox.showwarning("Warning", "Image is still loading")
+            return False
+            
+        if self.current_image is None:
             messagebox.showwarning("Warning", "No image loaded")
+            return False
+            
+        if self.module_task:
+            messagebox.showwarning("Warning", "A module is already running")
+            return False
+        return True
+        
+    def run_module(self, module_path):
+        """Start a module on current image"""
+        if not self.can_start_module():
             return
             
+        from plugins import get_plugin, get_module_modes
+        from workers import ThreadJob
+        
+        task = {'module': module_path, 'details': {'module': module_path}, 'output_path': None, 'handoff_paths': [],
+                'span': begin("module.total", module=os.path.basename(module_path))}
         try:
-            # Prepare next image path
-            next_index = self.current_image_index + 1
-            next_path = os.path.join(self.temp_dir, f"image{next_index}.png")
-            
-            # Remove future images (for undo/redo)
-            self.remove_future_images(next_index)
-            
-            # Run module
-            cmd = [sys.executable, module_path, "-i", current_path, "-o", next_path]
-            print(f"Running: {' '.join(cmd)}")
-            
-            result = subprocess.run(cmd, capture_output=True, text=True)
-            
-            if result.returncode == 0:
-                # Check if output file was actually created
-                if os.path.exists(next_path):
-                    # Success - update current image
-                    self.current_image_index = next_index
-                    self.max_image_index = next_index
-                    self.image_viewer.load_image(next_path)
-                    print(f"Module executed successfully: {module_path}")
-                else:
-                    # Module ran but no output file created (user cancelled)
-                    print(f"Module completed but no output file created: {module_path}")
+            # Modules exporting process(image) run in-process on the current image
+            plugin = get_plugin(module_path)
+            if plugin:
+                print(f"Running in-process: {module_path}")
+                task['job'] = ThreadJob(self.run_plugin_job, plugin, get_module_modes(module_path), self.current_image)
             else:
-                # Error - show message and clean up
-                error_msg = result.stderr or result.stdout or "Unknown error"
-                messagebox.showerror("Module Error", f"Module failed: {error_msg}")
-                print(f"Module error: {error_msg}")
+                task['job'] = self.start_module_script(module_path, task)
                 
-                # Remove failed output file if it exists
-                if os.path.exists(next_path):
-                    os.remove(next_path)
-                    
         except Exception as e:
+            self.remove_task_files(task)
             messagebox.showerror("Error", f"Cannot run module: {str(e)}")
             print(f"Error running module: {str(e)}")
-                        
-    def remove_future_images(self, from_index):
-        """Remove images with index >= from_index"""
-        if not self.current_image_path:
             return
-        
-        for i in range(from_index, self.max_image_index + 10):  # Remove some extra just in case
-            image_path = os.path.join(self.temp_dir, f"image{i}.png")
-            if os.path.exists(image_path):
-                os.remove(image_path)
+            
+        self.module_task = task
+        self.set_status(f"Running {os.path.basename(module_path)}...", running=True)
+        self.poll_module_task()
+        
+    def run_plugin_job(self, plugin, modes, image):
+        """Convert image to a mode plugin accepts and run it, on the job thread"""
+        from plugins import convert_for_module, run_plugin
+        from tilestore import TiledImage
+        with span("module.convert"):
+            if isinstance(image, TiledImage):
+                # In-process modules work on a regular image
+                image = image.to_image()
+            image = convert_for_module(image, modes)
+        with span("module.plugin"):
+            return run_plugin(plugin, image)
+        
+    def start_module_script(self, module_path, task):
+        """Start script module in a warm worker process"""
+        from plugins import get_module_info, get_module_modes, convert_for_module
+        from pixelbuffer import save_image
+        with span("module.convert"):
+            image = convert_for_module(self.current_image, get_module_modes(module_path))
+        if get_module_info(module_path).get('pixel_buffer'):
+            # Module reads and writes pixel buffers directly, output becomes the next history state
+            output_path = self.history.get_next_path()
+            with span("module.handoff_write", format="pixel buffer"):
+                if image is self.current_image:
+                    input_path = self.history.get_current_path()
+                else:
+                    input_path = os.path.join(self.temp_dir, "module_input.pix")
+                    task['handoff_paths'] = [input_path]
+                    save_image(image, input_path)
+        else:
+            # Hand off to legacy modules as uncompressed TIFF
+            input_path = os.path.join(self.temp_dir, "module_input.tif")
+            output_path = os.path.join(self.temp_dir, "module_output.tif")
+            task['handoff_paths'] = [input_path, output_path]
+            with span("module.handoff_write", format="TIFF"):
+                image.save(input_path, 'TIFF')
+        task['output_path'] = output_path
+        
+        args = ["-i", input_path, "-o", output_path]
+        print(f"Running: {' '.join([sys.executable, module_path] + args)}")
+        
+        # Worker time, from handing over the job until it exits
+        task['process_span'] = begin("module.process")
+        return self.module_pool.start(module_path, args)
+        
+    def poll_module_task(self):
+        """Stream progress of running module and finish it when done"""
+        task = self.module_task
+        if not task:
+            return
+            
+        for line in task['job'].poll():
+            print(line)
+            self.set_status(line, running=True)
+            
+        if not task['job'].done:
+            self.after(JOB_POLL_DELAY, self.poll_module_task)
+            return
+            
+        # Viewer and history only change once the job completes
+        self.module_task = None
+        if 'process_span' in task:
+            task['process_span'].end()
+        try:
+            from workers import ThreadJob
+            if isinstance(task['job'], ThreadJob):
+                self.finish_in_process_task(task)
+            else:
+                self.finish_script_task(task)
+        except Exception as e:
+            messagebox.showerror("Error", f"Cannot run module: {str(e)}")
+            print(f"Error running module: {str(e)}")
+        finally:
+            self.remove_task_files(task)
+            self.set_status("Ready")
+            task['span'].end()
+            
+    def finish_script_task(self, task):
+        """Take over output of finished script module"""
+        from pixelbuffer import open_image
+        from tilestore import open_tiled
+        module_path = task['module']
+        output_path = task['output_path']
+        result = task['job'].result
+        
+        if result.returncode == 0:
+            # Check if output file was actually created
+            if os.path.exists(output_path):
+                # Success - update current image
+                with span("module.read_output"):
+                    image = open_tiled(output_path) or open_image(output_path)
+                owned_path = None if output_path in task['handoff_paths'] else output_path
+                with span("module.history_push"):
+                    image = self.history.push(image, path=owned_path, **task['details'])
+                self.set_current_image(image)
+                task['output_path'] = None
+                print(f"Module executed successfully: {module_path}")
+            else:
+                # Module ran but no output file created (user cancelled)
+                print(f"Module completed but no output file created: {module_path}")
+        else:
+            # Error - show message
+            error_msg = result.stderr or result.stdout or "Unknown error"
+            messagebox.showerror("Module Error", f"Module failed: {error_msg}")
+            print(f"Module error: {error_msg}")
+            
+    def finish_in_process_task(self, task):
+        """Take over result of finished in-process module"""
+        module_path = task['module']
+        job = task['job']
+        
+        if job.error:
+            messagebox.showerror("Module Error", f"Module failed: {str(job.error)}")
+            print(f"Module error: {str(job.error)}")
+            return
+            
+        if job.value is None:
+            # Module produced no image (user cancelled)
+            print(f"Module completed but no output image created: {module_path}")
+            return
+            
+        # Success - add to history and update current image
+        with span("module.history_push"):
+            image = self.history.push(job.value, **task['details'])
+        self.set_current_image(image)
+        print(f"Module executed successfully: {module_path}")
+        
+    def save_macro(self):
+        """Save modules applied to current image as macro file"""
+        import macros
+        module_paths = macros.get_recorded_modules(self.history.get_details())
+        if not module_paths:
+            messagebox.showwarning("Warning", "No modules have been applied to record")
+            return
+            
+        file_path = filedialog.asksaveasfilename(
+            title="Save Macro",
+            defaultextension=macros.MACRO_EXTENSION,
+            filetypes=[("Openpix macros", "*" + macros.MACRO_EXTENSION), ("All files", "*.*")]
+        )
+        if file_path:
+            try:
+                macros.save_macro(file_path, module_paths, self.modules_dir)
+                self.set_status(f"Saved macro with {len(module_paths)} modules")
+            except Exception as e:
+                messagebox.showerror("Error", f"Cannot save macro: {str(e)}")
+                
+    def play_macro(self):
+        """Replay macro file on current image as one edit"""
+        if not self.can_start_module():
+            return
+            
+        import macros
+        file_path = filedialog.askopenfilename(
+            title="Play Macro",
+            filetypes=[("Openpix macros", "*" + macros.MACRO_EXTENSION), ("All files", "*.*")]
+        )
+        if not file_path:
+            return
+            
+        try:
+            module_paths = macros.load_macro(file_path, self.modules_dir)
+            stages = macros.compile_chain(module_paths)
+        except Exception as e:
+            messagebox.showerror("Error", f"Cannot load macro: {str(e)}")
+            print(f"Error loading macro: {str(e)}")
+            return
+            
+        if not module_paths:
+            messagebox.showwarning("Warning", "Macro contains no modules")
+            return
+            
+        # Consecutive in-process modules run as one pass without temp files
+        task = {
+            'module': file_path,
+            'details': {'modules': module_paths},
+            'output_path': None,
+            'handoff_paths': [],
+            'span': begin("macro.total", macro=os.path.basename(file_path), modules=len(module_paths)),
+            'stage_job': None,
+            'cancelled': False
+        }
+        from workers import ThreadJob
+        task['job'] = ThreadJob(self.run_macro_job, task, stages, self.current_image)
+        self.module_task = task
+        self.set_status(f"Running {os.path.basename(file_path)} ({len(module_paths)} modules in {len(stages)} passes)...",
+                        running=True)
+        self.poll_module_task()
+        
+    def run_macro_job(self, task, stages, image):
+        """Run compiled macro on image, on the job thread"""
+        import tempfile
+        from macros import run_chain
+        from tilestore import TiledImage
+        if isinstance(image, TiledImage):
+            image = image.to_image()
+        work_dir = tempfile.mkdtemp(prefix="macro_", dir=self.temp_dir)
+        try:
+            return run_chain(image, stages, work_dir,
+                             lambda module_path, args: self.run_pool_script(task, module_path, args))
+        finally:
+            shutil.rmtree(work_dir, ignore_errors=True)
+            
+    def run_pool_script(self, task, module_path, args):
+        """Run script module of task in a warm worker and wait, returns (returncode, stdout, stderr)"""
+        # Cancel kills the stage job, and no stage starts after it
+        with self.stage_lock:
+            if task['cancelled']:
+                return 1, "", "Cancelled"
+            job = self.module_pool.start(module_path, args)
+            task['stage_job'] = job
+        result = job.wait()
+        return result.returncode, result.stdout, result.stderr
+        
+    def cancel_module(self):
+        """Cancel running module"""
+        task = self.module_task
+        if not task:
+            return
+            
+        self.module_task = None
+        task['job'].cancel()
+        with self.stage_lock:
+            # Macro stage running in a pool worker
+            task['cancelled'] = True
+            stage_job = task.get('stage_job')
+        if stage_job:
+            stage_job.cancel()
+        self.remove_task_files(task)
+        self.set_status("Cancelled")
+        print(f"Module cancelled: {task['module']}")
+        
+    def remove_task_files(self, task):
+        """Remove hand-off files and output not taken over by history"""
+        for path in task['handoff_paths'] + [task['output_path']]:
+            if path and os.path.exists(path):
+                os.remove(path)
                 
+    def set_status(self, text, running=False):
+        """Show text in status bar, enabling Cancel while a module runs"""
+        self.status_label.configure(text=text)
+        self.cancel_btn.configure(state="normal" if running else "disabled")
+        
     def undo(self):
         """Undo last operation"""
-        if self.current_image_index > 0:
-            self.current_image_index -= 1
-            current_path = self.get_current_image_path()
-            if os.path.exists(current_path):
-                self.image_viewer.load_image(current_path)
+        if self.module_task:
+            self.set_status("Wait for the running module to finish or cancel it", running=True)
+        elif self.history.can_undo():
+            with span("history.undo"):
+                image = self.history.undo()
+            self.set_current_image(image)
                 
     def redo(self):
         """Redo last undone operation"""
-        if self.current_image_index < self.max_image_index:
-            self.current_image_index += 1
-            current_path = self.get_current_image_path()
-            if os.path.exists(current_path):
-                self.image_viewer.load_image(current_path)
+        if self.module_task:
+            self.set_status("Wait for the running module to finish or cancel it", running=True)
+        elif self.history.can_redo():
+            with span("history.redo"):
+                image = self.history.redo()
+            self.set_current_image(image)
                 
+    def toggle_hud(self, event=None):
+        """Show or hide viewer timing HUD"""
+        self.image_viewer.set_hud(not self.image_viewer.hud_enabled)
+        
     def actual_size(self):
         """Show image at actual size"""
         if self.image:
@@ -668,8 +1646,7 @@ class OpenpixApp(ctk.CTk):
         
     def save_file(self):
         """Save current image"""
-        current_path = self.get_current_image_path()
-        if not current_path or not os.path.exists(current_path):
+        if self.current_image is None:
             messagebox.showwarning("Warning", "No image to save")
             return
             
@@ -679,21 +1656,20 @@ class OpenpixApp(ctk.CTk):
             
         try:
             # Overwrite the original input image
-            shutil.copy2(current_path, self.original_file_path)
+            self.write_image_file(self.original_file_path)
             messagebox.showinfo("Success", "Image saved successfully")
         except Exception as e:
             messagebox.showerror("Error", f"Cannot save image: {str(e)}")
             
     def save_as_file(self):
         """Save image as new file"""
-        current_path = self.get_current_image_path()
-        if not current_path or not os.path.exists(current_path):
+        if self.current_image is None:
             messagebox.showwarning("Warning", "No image to save")
             return
             
         file_path = filedialog.asksaveasfilename(
             title="Save Image",
-            defaultextension=os.path.splitext(current_path)[1],
+            defaultextension=os.path.splitext(self.original_file_path or "")[1] or ".png",
             filetypes=[
                 ("JPEG files", "*.jpg"),
                 ("PNG files", "*.png"),
@@ -704,16 +1680,49 @@ class OpenpixApp(ctk.CTk):
         
         if file_path:
             try:
-                shutil.copy2(current_path, file_path)
+                self.write_image_file(file_path)
                 messagebox.showinfo("Success", "Image saved successfully")
             except Exception as e:
                 messagebox.showerror("Error", f"Cannot save image: {str(e)}")
                 
+    def write_image_file(self, file_path):
+        """Encode current image in the format given by file extension"""
+        from tilestore import TiledImage
+        image = self.current_image
+        if isinstance(image, TiledImage):
+            # Encoders need the whole image
+            image = image.to_image()
+        extension = os.path.splitext(file_path)[1].lower()
+        if extension in ('.jpg', '.jpeg') and image.mode not in ('RGB', 'L', 'CMYK'):
+            # JPEG has no alpha channel, palette or 16-bit modes
+            image = get_display_image(image).convert('RGB')
+            
+        # Write beside the target and swap it in, images opened lazily from
+        # the old file keep reading its contents through their open handle
+        directory, name = os.path.split(os.path.abspath(file_path))
+        temp_path = os.path.join(directory, f".{name}.{os.getpid()}.tmp{extension}")
+        try:
+            image.save(temp_path)
+            if os.path.exists(file_path):
+                shutil.copymode(file_path, temp_path)
+            try:
+                os.replace(temp_path, file_path)
+            except PermissionError:
+                # Windows cannot replace a file that is still open, stop reading it lazily first
+                self.history.load_file(file_path)
+                self.set_current_image(self.history.current())
+                os.replace(temp_path, file_path)
+        except Exception:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+            raise
+                
     def open_settings(self):
         """Open settings window"""
         settings_path = "setting.py"
         if os.path.exists(settings_path):
             try:
+                import subprocess
                 subprocess.Popen([sys.executable, settings_path])
             except Exception as e:
                 messagebox.showerror("Error", f"Cannot open settings: {str(e)}")
@@ -721,12 +1730,26 @@ class OpenpixApp(ctk.CTk):
             messagebox.showwarning("Warning", "Settings file not found")
 
 def main():
+    import argparse
+    parser = argparse.ArgumentParser(description="Openpix - Modular Image Editor")
+    parser.add_argument('image', nargs='?', help='Image file to open')
+    parser.add_argument('--new-instance', action='store_true',
+                        help='Open a separate window instead of handing the image to a running Openpix')
+    parser.add_argument('--hud', action='store_true', help='Show render timing and memory use over the image (toggle with F3)')
+    parser.add_argument('--trace', nargs='?', const='', metavar='FILE',
+                        help='Write a Chrome trace of this session on exit (default: cache/traces/)')
+    args = parser.parse_args()
+    
+    if args.trace is not None:
+        from tracing import enable_trace_file
+        print(f"Tracing to {enable_trace_file(args.trace or None)}")
+    
     # Set appearance mode
     ctk.set_appearance_mode("dark")
     ctk.set_default_color_theme("blue")
     
     # Create and run app
-    app = OpenpixApp()
+    app = OpenpixApp(args.image, single_instance=not args.new_instance, show_hud=args.hud)
     app.mainloop()
 
 if __name__ == "__main__":
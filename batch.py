@@ -0,0 +1,137 @@
+"""
+Headless batch processing for Openpix
+
+Runs an ordered chain of modules over many images without opening a
+window:
+
+    python app.py batch photos/ "scans/*.tif" -m filters/blur -m sharpen -o out/
+
+or replays a saved macro with --macro. Files are spread over a process
+pool sized to the CPU count. Inside a worker, consecutive modules
+exporting process(image) run as one fused pass on the in-memory image;
+script modules run in the worker's interpreter with the same -i/-o
+hand-off the editor uses.
+"""
+
+import os
+import sys
+import glob
+import time
+import shutil
+import argparse
+import tempfile
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from pixelbuffer import open_image, save_image
+from macros import resolve_module, load_macro, compile_chain, run_chain
+
+# Extensions picked up when an input is a directory
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.bmp', '.gif', '.tif', '.tiff', '.webp')
+
+def collect_inputs(patterns):
+    """Expand input files, globs and directories, returns list of (path, output name)"""
+    inputs = []
+    for pattern in patterns:
+        if os.path.isdir(pattern):
+            # Keep the directory layout below the input directory
+            for root, dirs, files in os.walk(pattern):
+                dirs.sort()
+                for filename in sorted(files):
+                    if os.path.splitext(filename)[1].lower() in IMAGE_EXTENSIONS:
+                        path = os.path.join(root, filename)
+                        inputs.append((path, os.path.relpath(path, pattern)))
+        else:
+            matches = sorted(glob.glob(pattern, recursive=True)) or [pattern]
+            for path in matches:
+                if os.path.isfile(path):
+                    inputs.append((path, os.path.basename(path)))
+                else:
+                    print(f"Skipping {path}: not a file")
+    return inputs
+
+def save_output(image, output_path):
+    """Encode result in the format given by the extension"""
+    extension = os.path.splitext(output_path)[1].lower()
+    if extension in ('.jpg', '.jpeg') and image.mode not in ('RGB', 'L', 'CMYK'):
+        # JPEG has no alpha channel, palette or 16-bit modes
+        image = image.convert('RGB')
+    save_image(image, output_path)
+
+def get_output_path(output_dir, name, format=None):
+    """Get output file path for input name, replacing the extension when format is given"""
+    if format:
+        name = os.path.splitext(name)[0] + "." + format.lower()
+    return os.path.join(output_dir, name)
+
+def process_file(input_path, output_path, module_paths):
+    """Run module chain on one file, returns (input path, output path, seconds, error)"""
+    start = time.perf_counter()
+    work_dir = tempfile.mkdtemp(prefix="openpix_batch_")
+    try:
+        image = run_chain(open_image(input_path), compile_chain(module_paths), work_dir)
+        if image is None:
+            raise RuntimeError("A module produced no image")
+
+        os.makedirs(os.path.dirname(output_path) or ".", exist_ok=True)
+        save_output(image, output_path)
+        error = None
+    except Exception as e:
+        error = str(e)
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+    return input_path, output_path, time.perf_counter() - start, error
+
+def run_batch(inputs, module_paths, output_dir, jobs=None, format=None):
+    """Process inputs on a process pool, printing progress, returns number of failed files"""
+    jobs = jobs or os.cpu_count() or 1
+    os.makedirs(output_dir, exist_ok=True)
+    print(f"Processing {len(inputs)} images with {len(module_paths)} modules on {jobs} processes")
+
+    failed = 0
+    start = time.perf_counter()
+    with ProcessPoolExecutor(max_workers=jobs) as pool:
+        futures = [
+            pool.submit(process_file, path, get_output_path(output_dir, name, format), module_paths)
+            for path, name in inputs
+        ]
+        for done, future in enumerate(as_completed(futures), 1):
+            input_path, output_path, seconds, error = future.result()
+            if error:
+                failed += 1
+                print(f"[{done}/{len(inputs)}] {input_path}: FAILED after {seconds:.2f}s: {error}")
+            else:
+                print(f"[{done}/{len(inputs)}] {input_path} -> {output_path}: {seconds:.2f}s")
+
+    elapsed = time.perf_counter() - start
+    rate = len(inputs) / elapsed if elapsed > 0 else 0.0
+    print(f"Done: {len(inputs) - failed} succeeded, {failed} failed in {elapsed:.2f}s ({rate:.2f} images/sec)")
+    return failed
+
+def main(argv=None):
+    """Command line entry point for python app.py batch"""
+    parser = argparse.ArgumentParser(prog="app.py batch", description="Run a chain of Openpix modules over many images")
+    parser.add_argument('inputs', nargs='+', help='Input files, glob patterns or directories')
+    parser.add_argument('-m', '--module', action='append', dest='modules', default=[],
+                        help='Module to run, in order (path, path below modules/ or file name)')
+    parser.add_argument('--macro', help='Macro file to replay before the -m modules')
+    parser.add_argument('-o', '--output', required=True, help='Output directory')
+    parser.add_argument('-j', '--jobs', type=int, default=os.cpu_count(), help='Number of worker processes')
+    parser.add_argument('-f', '--format', help='Output format extension, e.g. png (default: keep input format)')
+    args = parser.parse_args(argv)
+
+    try:
+        module_paths = load_macro(args.macro) if args.macro else []
+        module_paths += [resolve_module(name) for name in args.modules]
+    except (OSError, ValueError) as e:
+        parser.error(str(e))
+    if not module_paths:
+        parser.error("No modules given, use -m or --macro")
+
+    inputs = collect_inputs(args.inputs)
+    if not inputs:
+        parser.error("No input images found")
+
+    failed = run_batch(inputs, module_paths, args.output, args.jobs, args.format)
+    return 1 if failed else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,317 @@
+"""
+Headless benchmarks for Openpix hot paths
+
+Times the code behind the viewer, image loading, the module hand-off
+and the Crop tool on synthetic images, without opening a window:
+
+    python bench.py --sizes 1,12,50,200 --output baseline.json
+    python bench.py --sizes 1,12,50,200 --compare baseline.json
+
+The viewer is measured through the same pyramid and tile functions
+ImageViewer renders with; the Crop tool through the transform and
+preview helpers of modules/Crop.py. Results are stored as JSON; --compare runs the suite
+again and flags benchmarks that got slower than the baseline by more
+than the threshold (exit code 1 if any did). Groups that fail, for
+example when a TIFF above Pillow's decompression bomb limit does not
+open, also make it exit with code 1.
+"""
+
+import os
+import sys
+import json
+import math
+import time
+import shutil
+import argparse
+import platform
+import tempfile
+import statistics
+import importlib.util
+import PIL
+from PIL import Image
+from app import (ImagePyramid, get_display_size, get_visible_tiles, render_tiles,
+                 decode_image, decode_preview, TILE_SIZE)
+from history import EditHistory
+from pixelbuffer import open_image, save_image
+from workers import ModuleWorkerPool
+
+BENCH_VERSION = 1
+DEFAULT_SIZES = "1,12,50,200"
+DEFAULT_MODES = "L,RGB,RGBA"
+CANVAS_SIZE = (1600, 1000)
+CROP_CANVAS_SIZE = (1200, 800)
+CROP_SCREEN_SIZE = (1920, 1080)
+
+# Pillow's decompression bomb limit, lifted for the synthetic images but not for opening TIFFs
+PILLOW_PIXEL_LIMIT = Image.MAX_IMAGE_PIXELS
+
+# Slowdowns below this many seconds are treated as noise when comparing
+NOISE_FLOOR = 0.002
+
+# Module that hands its input back unchanged, as pixel buffer or legacy TIFF
+PASSTHROUGH_MODULE = '''
+import argparse
+from pixelbuffer import open_image, save_image
+OPENPIX_PIXEL_BUFFER = {pixel_buffer}
+parser = argparse.ArgumentParser()
+parser.add_argument('-i', '--input', required=True)
+parser.add_argument('-o', '--output', required=True)
+args = parser.parse_args()
+save_image(open_image(args.input), args.output)
+'''
+
+def make_image(mode, megapixels):
+    """Create synthetic 4:3 test image of about megapixels million pixels"""
+    width = int(math.sqrt(megapixels * 1e6 * 4 / 3))
+    height = int(width * 3 / 4)
+
+    # Smooth gradient with some noise, so encoders see realistic content
+    gradient = Image.linear_gradient('L').resize((width, height), Image.Resampling.BILINEAR)
+    luminance = Image.blend(gradient, Image.effect_noise((width, height), 32), 0.25)
+    if mode == 'L':
+        return luminance
+
+    bands = [luminance, luminance.transpose(Image.FLIP_LEFT_RIGHT), luminance.transpose(Image.FLIP_TOP_BOTTOM)]
+    if mode == 'RGBA':
+        bands.append(gradient.transpose(Image.ROTATE_180))
+    return Image.merge(mode, bands)
+
+def measure(function, repeat):
+    """Run function repeat times, returns {'seconds': fastest, 'median': median} in seconds"""
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function()
+        times.append(time.perf_counter() - start)
+    return {'seconds': min(times), 'median': statistics.median(times)}
+
+def render_frame(pyramid, image_size, scale, final):
+    """Render all tiles of a centered canvas frame, as ImageViewer.update_display queues them"""
+    display_size = get_display_size(image_size, scale)
+    offset = ((CANVAS_SIZE[0] - display_size[0]) // 2, (CANVAS_SIZE[1] - display_size[1]) // 2)
+    keys = [(display_size, column, row) for column, row in get_visible_tiles(display_size, offset, CANVAS_SIZE, TILE_SIZE)]
+    for result in render_tiles(pyramid, scale, keys, final):
+        pass
+
+def bench_viewer(image, repeat):
+    """Viewer: first frame (pyramid build), zoom frame and 100% preview frame"""
+    fit_scale = min(CANVAS_SIZE[0] / image.width, CANVAS_SIZE[1] / image.height)
+    pyramid = ImagePyramid(image)
+    return {
+        'viewer.first_frame': measure(lambda: render_frame(ImagePyramid(image), image.size, fit_scale, True), repeat),
+        'viewer.zoom_frame': measure(lambda: render_frame(pyramid, image.size, fit_scale * 1.1, True), repeat),
+        'viewer.preview_frame_100': measure(lambda: render_frame(pyramid, image.size, 1.0, False), repeat),
+        'viewer.final_frame_100': measure(lambda: render_frame(pyramid, image.size, 1.0, True), repeat)
+    }
+
+def bench_load(image, work_dir, repeat):
+    """Loading: full decode, JPEG draft preview and pixel buffer open"""
+    results = {}
+    if image.mode in ('L', 'RGB'):
+        path = os.path.join(work_dir, "load.jpg")
+        image.save(path, quality=90)
+        results['load.decode_jpeg'] = measure(lambda: decode_image(path), repeat)
+        results['load.preview_jpeg'] = measure(lambda: decode_preview(path, (1920, 1080)), repeat)
+    else:
+        path = os.path.join(work_dir, "load.png")
+        image.save(path, compress_level=1)
+        results['load.decode_png'] = measure(lambda: decode_image(path), repeat)
+
+    path = os.path.join(work_dir, "load.pix")
+    save_image(image, path)
+    results['load.open_pixel_buffer'] = measure(lambda: open_image(path).load(), repeat)
+
+    tiff_path = os.path.join(work_dir, "load.tif")
+    image.save(tiff_path, 'TIFF')
+    results['load.open_tiff'] = measure(lambda: open_as_app(tiff_path, image.size), repeat)
+    return results
+
+def open_as_app(path, size):
+    """Open path through the preview and decode steps of OpenpixApp.load_image, under Pillow's own pixel limit
+
+    Sizes above the limit must still open, lazily, so this raises if they do not.
+    """
+    limit = Image.MAX_IMAGE_PIXELS
+    Image.MAX_IMAGE_PIXELS = PILLOW_PIXEL_LIMIT
+    try:
+        opened = decode_image(path, decode_preview(path, (1920, 1080)))
+    finally:
+        Image.MAX_IMAGE_PIXELS = limit
+    if opened.size != size:
+        raise RuntimeError(f"{path} opened as {opened.size}, expected {size}")
+
+def bench_modules(image, work_dir, pool, repeat):
+    """Module hand-off: pixel buffer and TIFF round trips through a warm worker"""
+    results = {}
+    for name, pixel_buffer in (('pixel_buffer', True), ('tiff', False)):
+        module_path = os.path.join(work_dir, f"passthrough_{name}.py")
+        with open(module_path, "w", encoding="utf-8") as f:
+            f.write(PASSTHROUGH_MODULE.format(pixel_buffer=pixel_buffer))
+
+        def round_trip():
+            history = EditHistory(work_dir)
+            history.reset(image)
+            if pixel_buffer:
+                input_path = history.get_current_path()
+                output_path = history.get_next_path()
+            else:
+                input_path = os.path.join(work_dir, "module_input.tif")
+                output_path = os.path.join(work_dir, "module_output.tif")
+                image.save(input_path, 'TIFF')
+            result = pool.run(module_path, ["-i", input_path, "-o", output_path])
+            if result.returncode != 0:
+                raise RuntimeError(result.stderr)
+            history.push(open_image(output_path), path=output_path if pixel_buffer else None)
+            history.clear()
+
+        results[f'module.roundtrip_{name}'] = measure(round_trip, repeat)
+    return results
+
+def load_crop_module():
+    """Import modules/Crop.py, which is a script rather than a package module"""
+    spec = importlib.util.spec_from_file_location("openpix_crop", os.path.join("modules", "Crop.py"))
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+def bench_crop(image, repeat):
+    """Crop tool: button clicks up to the new preview, and the full resolution result on Done"""
+    crop = load_crop_module()
+    fillcolor = (255, 255, 255, 0)[:len(image.getbands())]
+    proxy = crop.DisplayProxy(crop.PreviewPyramid(image), fillcolor)
+    start = crop.ImageTransform(image.size)
+    box = (image.width // 4, image.height // 4, image.width * 3 // 4, image.height * 3 // 4)
+
+    def show(transform, canvas_size):
+        """Draw the preview of transform on a canvas, as ImageCropTool does"""
+        scale = min(canvas_size[0] / transform.size[0], canvas_size[1] / transform.size[1], 1.0)
+        size = (max(1, int(transform.size[0] * scale)), max(1, int(transform.size[1] * scale)))
+        proxy_scale = min(CROP_SCREEN_SIZE[0] / transform.size[0], CROP_SCREEN_SIZE[1] / transform.size[1], 1.0)
+        return proxy.get_image(transform, size, proxy_scale)
+
+    def click(operation):
+        """Apply operation to the transform and draw the new preview"""
+        return show(operation(start), CROP_CANVAS_SIZE)
+
+    def resize():
+        """Show the unchanged transform on a canvas growing by a few pixels, as when dragging the window edge"""
+        for step in range(1, 11):
+            show(start, (CROP_CANVAS_SIZE[0] + step * 8, CROP_CANVAS_SIZE[1] + step * 5))
+
+    exact = start.transpose(Image.Transpose.ROTATE_90).transpose(Image.Transpose.FLIP_LEFT_RIGHT).crop(box)
+    rotated = start.rotate(15).crop(box)
+    return {
+        'crop.rotate_90': measure(lambda: click(lambda t: t.transpose(Image.Transpose.ROTATE_90)), repeat),
+        'crop.mirror': measure(lambda: click(lambda t: t.transpose(Image.Transpose.FLIP_LEFT_RIGHT)), repeat),
+        'crop.rotate_15': measure(lambda: click(lambda t: t.rotate(15)), repeat),
+        'crop.crop': measure(lambda: click(lambda t: t.crop(box)), repeat),
+        'crop.display_resize': measure(resize, repeat),
+        'crop.done_exact': measure(lambda: exact.apply(image).load(), repeat),
+        'crop.done_rotate_15': measure(lambda: rotated.apply(image, fillcolor).load(), repeat)
+    }
+
+def run_suite(sizes, modes, groups, repeat):
+    """Run selected benchmark groups for every size and mode, returns ({name: result}, failed group count)"""
+    results = {}
+    failures = 0
+    work_dir = tempfile.mkdtemp(prefix="openpix_bench_")
+    pool = ModuleWorkerPool(size=1) if 'modules' in groups else None
+    try:
+        for megapixels in sizes:
+            for mode in modes:
+                label = f"{mode}/{megapixels:g}MP"
+                print(f"{label}: generating image", flush=True)
+                image = make_image(mode, megapixels)
+
+                runs = {
+                    'viewer': lambda image=image: bench_viewer(image, repeat),
+                    'load': lambda image=image: bench_load(image, work_dir, repeat),
+                    'modules': lambda image=image: bench_modules(image, work_dir, pool, repeat),
+                    'crop': lambda image=image: bench_crop(image, repeat)
+                }
+                for group in groups:
+                    try:
+                        group_results = runs[group]()
+                    except Exception as e:
+                        # Keep going, e.g. when an image is too large for this machine
+                        print(f"{label}: {group} failed: {e}")
+                        failures += 1
+                        continue
+                    for name, result in group_results.items():
+                        results[f"{name}/{label}"] = result
+                        print(f"{label}: {name:<28} {result['seconds'] * 1000:10.1f} ms", flush=True)
+                # Free this image before the next one is generated
+                del image, runs
+    finally:
+        if pool:
+            pool.close()
+        shutil.rmtree(work_dir, ignore_errors=True)
+    return results, failures
+
+def compare_results(baseline, results, threshold):
+    """Print comparison with baseline results, returns number of slowdowns"""
+    slowdowns = 0
+    print(f"\n{'benchmark':<44} {'baseline':>10} {'current':>10} {'change':>8}")
+    for name in sorted(results):
+        if name not in baseline:
+            continue
+        old = baseline[name]['seconds']
+        new = results[name]['seconds']
+        change = (new - old) / old if old > 0 else 0.0
+        flag = ""
+        if change > threshold and new - old > NOISE_FLOOR:
+            flag = "  SLOWER"
+            slowdowns += 1
+        elif change < -threshold and old - new > NOISE_FLOOR:
+            flag = "  faster"
+        print(f"{name:<44} {old * 1000:8.1f}ms {new * 1000:8.1f}ms {change:+7.1%}{flag}")
+    print(f"\n{slowdowns} benchmarks slower than baseline by more than {threshold:.0%}")
+    return slowdowns
+
+def main(argv=None):
+    """Command line entry point"""
+    parser = argparse.ArgumentParser(description="Benchmark Openpix hot paths without a display")
+    parser.add_argument('--sizes', default=DEFAULT_SIZES, help='Image sizes in megapixels, comma separated')
+    parser.add_argument('--modes', default=DEFAULT_MODES, help='Image modes, comma separated')
+    parser.add_argument('--only', default="viewer,load,modules,crop", help='Benchmark groups to run')
+    parser.add_argument('--repeat', type=int, default=3, help='Runs per benchmark, the fastest counts')
+    parser.add_argument('--output', help='Write results as JSON baseline to this file')
+    parser.add_argument('--compare', help='Compare with baseline JSON file and flag slowdowns')
+    parser.add_argument('--threshold', type=float, default=0.15, help='Relative slowdown flagged by --compare')
+    args = parser.parse_args(argv)
+
+    sizes = [float(size) for size in args.sizes.split(",")]
+    modes = args.modes.split(",")
+    groups = args.only.split(",")
+    unknown = set(groups) - {'viewer', 'load', 'modules', 'crop'}
+    if unknown:
+        parser.error(f"Unknown benchmark groups: {', '.join(sorted(unknown))}")
+
+    # Synthetic images above the decompression bomb limit are intended here
+    Image.MAX_IMAGE_PIXELS = None
+    results, failures = run_suite(sizes, modes, groups, args.repeat)
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump({
+                'version': BENCH_VERSION,
+                'created': time.strftime("%Y-%m-%dT%H:%M:%S"),
+                'python': platform.python_version(),
+                'pillow': PIL.__version__,
+                'machine': platform.machine(),
+                'results': results
+            }, f, indent=2)
+        print(f"Results written to {args.output}")
+
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as f:
+            baseline = json.load(f)
+        if compare_results(baseline.get('results', {}), results, args.threshold):
+            return 1
+    if failures:
+        print(f"{failures} benchmark groups failed")
+        return 1
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
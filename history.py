@@ -0,0 +1,316 @@
+"""
+Undo/redo history for Openpix
+
+Recent states are kept decoded in RAM so undo and redo are instant. When
+the states in RAM exceed the memory budget, the least recently used ones
+are spilled to disk and rebuilt on demand.
+
+Spilled states are stored as a keyframe (a full pixel buffer file) or as
+a delta against the previous state holding only the tiles whose hashes
+changed, so disk use grows with the amount of change rather than with
+the number of steps.
+"""
+
+import os
+from collections import OrderedDict
+from PIL import Image
+from pixelbuffer import PIXEL_BUFFER_EXTENSION, open_pixel_buffer, save_pixel_buffer, get_image_bytes
+
+# Default memory budget for decoded history states
+MEMORY_BUDGET = 1024 * 1024 * 1024
+
+# Delta storage configuration
+DELTA_TILE_SIZE = 256
+KEYFRAME_INTERVAL = 10
+MAX_DELTA_RATIO = 0.5
+
+def get_tile_boxes(size, tile_size=DELTA_TILE_SIZE):
+    """Get boxes of all tiles of an image, row by row"""
+    width, height = size
+    return [
+        (left, top, min(left + tile_size, width), min(top + tile_size, height))
+        for top in range(0, height, tile_size)
+        for left in range(0, width, tile_size)
+    ]
+
+def get_tile_hashes(image):
+    """Hash every tile of image, row by row"""
+    import hashlib
+    return [
+        hashlib.blake2b(image.crop(box).tobytes(), digest_size=16).digest()
+        for box in get_tile_boxes(image.size)
+    ]
+
+class EditHistory:
+    """Linear edit history with a RAM budget and disk spill"""
+    def __init__(self, spill_dir, memory_budget=MEMORY_BUDGET):
+        self.spill_dir = spill_dir
+        self.memory_budget = memory_budget
+        self.states = []
+        self.index = -1
+        self.next_id = 0
+
+        # States holding a decoded image, least recently used first
+        self.in_memory = OrderedDict()
+        self.memory_used = 0
+
+    def reset(self, image, **details):
+        """Drop all states and start a new history with image"""
+        self.clear()
+        return self.push(image, **details)
+
+    def clear(self):
+        """Drop all states"""
+        for state in self.states:
+            self.discard(state)
+        self.states = []
+        self.index = -1
+        self.in_memory.clear()
+        self.memory_used = 0
+
+    def push(self, image, path=None, **details):
+        """Add image as new current state, dropping redo states
+
+        path is an existing pixel buffer file holding image; the history
+        takes it over as the state's spill file. Extra keyword arguments are
+        kept with the state (for example the module that produced it).
+        """
+        for state in self.states[self.index + 1:]:
+            self.discard(state)
+        del self.states[self.index + 1:]
+
+        state = {
+            'id': self.next_id,
+            'image': None,
+            'path': path,
+            'keyframe': False,
+            'delta': None,
+            'hashes': None,
+            'size': image.size,
+            'mode': image.mode,
+            'details': details
+        }
+        self.next_id += 1
+        self.states.append(state)
+        self.index = len(self.states) - 1
+
+        self.keep_in_memory(state, image)
+        return image
+
+    def current(self):
+        """Get image of current state"""
+        if self.index < 0:
+            return None
+        return self.get_image(self.states[self.index])
+
+    def can_undo(self):
+        """Check if there is a state before the current one"""
+        return self.index > 0
+
+    def can_redo(self):
+        """Check if there is a state after the current one"""
+        return self.index < len(self.states) - 1
+
+    def undo(self):
+        """Step back, returns new current image"""
+        if self.can_undo():
+            self.index -= 1
+        return self.current()
+
+    def redo(self):
+        """Step forward, returns new current image"""
+        if self.can_redo():
+            self.index += 1
+        return self.current()
+
+    def load_file(self, path):
+        """Decode states still read lazily from path into RAM and close the file"""
+        from tilestore import TiledImage
+        path = os.path.normcase(os.path.abspath(path))
+        lazy = [state for state in self.states if isinstance(state['image'], TiledImage)
+                and os.path.normcase(os.path.abspath(state['image'].get_path())) == path]
+
+        # Decode all before closing any, derived images read through their parent
+        images = [state['image'] for state in lazy]
+        for state in lazy:
+            self.keep_in_memory(state, state['image'].to_image())
+        for image in images:
+            image.close()
+
+    def get_next_path(self):
+        """Get spill file path the next pushed state will own, for modules to write to"""
+        return self.get_state_path(self.next_id)
+
+    def get_state_path(self, state_id):
+        """Get spill file path of state"""
+        return os.path.join(self.spill_dir, f"history{state_id}{PIXEL_BUFFER_EXTENSION}")
+
+    def get_current_path(self):
+        """Get pixel buffer file of current state, writing it if it only lives in RAM"""
+        state = self.states[self.index]
+        if not state['path']:
+            self.write_state(state, self.get_image(state))
+        return state['path']
+
+    def get_details(self):
+        """Get extra details of states up to the current one, oldest first"""
+        return [state['details'] for state in self.states[:self.index + 1]]
+
+    def get_image(self, state):
+        """Get decoded image of state, rebuilding it from disk if spilled"""
+        image = state['image']
+        if image is not None:
+            if state['id'] in self.in_memory:
+                self.in_memory.move_to_end(state['id'])
+            return image
+
+        image = self.rebuild(self.states.index(state))
+        self.keep_in_memory(state, image)
+        return image
+
+    def rebuild(self, index):
+        """Rebuild image of state at index from the nearest decoded or keyframe state"""
+        chain = []
+        while True:
+            state = self.states[index]
+            if state['image'] is not None:
+                base = state['image']
+                break
+            if state['delta'] is None:
+                base = open_pixel_buffer(state['path'])
+                break
+            chain.append(state)
+            index -= 1
+
+        if not chain:
+            return base
+
+        # Replay deltas oldest first on a writable copy
+        image = base.copy()
+        for state in reversed(chain):
+            self.apply_delta(image, state)
+        return image
+
+    def apply_delta(self, image, state):
+        """Paste changed tiles stored for state onto image of the previous state"""
+        delta = state['delta']
+        with open(delta['path'], "rb") as f:
+            for box, offset, length in delta['tiles']:
+                f.seek(offset)
+                tile = Image.frombytes(image.mode, (box[2] - box[0], box[3] - box[1]), f.read(length))
+                image.paste(tile, box)
+        if delta['palette']:
+            image.putpalette(delta['palette'])
+
+    def get_hashes(self, state):
+        """Get tile hashes of state, computing them once"""
+        if state['hashes'] is None:
+            image = state['image']
+            if image is None:
+                image = self.rebuild(self.states.index(state))
+            state['hashes'] = get_tile_hashes(image)
+        return state['hashes']
+
+    def keep_in_memory(self, state, image):
+        """Hold decoded image for state and spill others to stay within budget"""
+        from tilestore import TiledImage
+        state['image'] = image
+        if isinstance(image, TiledImage):
+            # Decoded on demand from its file under its own memory cap, nothing to spill
+            return
+        self.in_memory[state['id']] = state
+        self.memory_used += get_image_bytes(image)
+        self.enforce_budget(keep=state)
+
+    def enforce_budget(self, keep):
+        """Spill least recently used states until memory use fits the budget"""
+        while self.memory_used > self.memory_budget and len(self.in_memory) > 1:
+            state_id, state = next(iter(self.in_memory.items()))
+            if state is keep:
+                self.in_memory.move_to_end(state_id)
+                continue
+            self.spill(state)
+
+    def spill(self, state):
+        """Move decoded image of state to disk"""
+        if not state['keyframe'] and state['delta'] is None:
+            self.store(state)
+
+        # Full file is redundant once the state is kept as a delta
+        if state['delta'] is not None and state['path']:
+            self.remove_file(state['path'])
+            state['path'] = None
+
+        self.release(state)
+
+    def store(self, state):
+        """Store state as delta against the previous state, or as keyframe"""
+        from tilestore import TiledImage
+        index = self.states.index(state)
+        parent = self.states[index - 1] if index > 0 else None
+
+        if (parent is None or index % KEYFRAME_INTERVAL == 0 or isinstance(parent['image'], TiledImage)
+                or parent['size'] != state['size'] or parent['mode'] != state['mode']):
+            self.store_keyframe(state)
+            return
+
+        hashes = self.get_hashes(state)
+        parent_hashes = self.get_hashes(parent)
+        changed = [i for i, (a, b) in enumerate(zip(hashes, parent_hashes)) if a != b]
+        if len(changed) > len(hashes) * MAX_DELTA_RATIO:
+            self.store_keyframe(state)
+            return
+
+        # Write changed tiles back to back, keep the index in RAM
+        image = state['image']
+        boxes = get_tile_boxes(image.size)
+        path = os.path.join(self.spill_dir, f"history{state['id']}.delta")
+        tiles = []
+        offset = 0
+        with open(path, "wb") as f:
+            for i in changed:
+                data = image.crop(boxes[i]).tobytes()
+                f.write(data)
+                tiles.append((boxes[i], offset, len(data)))
+                offset += len(data)
+
+        state['delta'] = {
+            'path': path,
+            'tiles': tiles,
+            'palette': image.getpalette() if image.mode in ('P', 'PA') else None
+        }
+
+    def store_keyframe(self, state):
+        """Store full image of state"""
+        if not state['path']:
+            self.write_state(state, state['image'])
+        state['keyframe'] = True
+
+    def release(self, state):
+        """Drop decoded image of state"""
+        if self.in_memory.pop(state['id'], None) is not None:
+            self.memory_used -= get_image_bytes(state['image'])
+        state['image'] = None
+
+    def write_state(self, state, image):
+        """Write state image to its spill file"""
+        path = self.get_state_path(state['id'])
+        save_pixel_buffer(image, path)
+        state['path'] = path
+
+    def discard(self, state):
+        """Forget state and remove its spill files"""
+        self.release(state)
+        if state['path']:
+            self.remove_file(state['path'])
+            state['path'] = None
+        if state['delta']:
+            self.remove_file(state['delta']['path'])
+            state['delta'] = None
+
+    def remove_file(self, path):
+        """Remove spill file"""
+        try:
+            os.remove(path)
+        except OSError as e:
+            print(f"Error deleting {path}: {e}")
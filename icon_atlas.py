@@ -0,0 +1,110 @@
+"""
+Pre-rendered module icon cache for Openpix
+
+Module icons are shown at 24x24. Instead of opening and resampling every
+icon file on each start, the resized icons are packed into one atlas
+image in the cache directory. A PNG text chunk in the atlas maps icon
+paths and modification times to atlas slots, so the whole cache is
+loaded with a single read and only new or changed icons are decoded.
+"""
+
+import os
+import json
+from PIL import Image
+from PIL.PngImagePlugin import PngInfo
+
+CACHE_DIR = "cache"
+ATLAS_FILE = "icon_atlas.png"
+ATLAS_KEY = "openpix-icons"
+ATLAS_VERSION = 1
+
+ICON_SIZE = 24
+ATLAS_COLUMNS = 32
+
+def render_icon(icon_path, size=ICON_SIZE):
+    """Load icon file resized to size x size RGBA"""
+    with Image.open(icon_path) as icon_image:
+        icon_image = icon_image.convert('RGBA')
+    return icon_image.resize((size, size), Image.Resampling.LANCZOS)
+
+def get_slot_box(slot, size=ICON_SIZE):
+    """Get atlas box of slot"""
+    left = slot % ATLAS_COLUMNS * size
+    top = slot // ATLAS_COLUMNS * size
+    return (left, top, left + size, top + size)
+
+class IconAtlas:
+    """Resized module icons packed in one cached image"""
+    def __init__(self, cache_dir=CACHE_DIR, size=ICON_SIZE):
+        self.path = os.path.join(cache_dir, ATLAS_FILE)
+        self.size = size
+
+        # Icon path -> {'mtime', 'slot'}
+        self.entries = {}
+        self.atlas = None
+        self.load()
+
+    def load(self):
+        """Read atlas file, starting empty if it is missing or outdated"""
+        try:
+            with Image.open(self.path) as atlas:
+                atlas.load()
+                data = json.loads(atlas.text.get(ATLAS_KEY, "{}"))
+        except (OSError, ValueError, AttributeError):
+            return
+
+        if data.get('version') != ATLAS_VERSION or data.get('size') != self.size:
+            return
+        self.entries = data.get('icons', {})
+        self.atlas = atlas.convert('RGBA') if atlas.mode != 'RGBA' else atlas
+
+    def save(self):
+        """Write atlas with its slot table"""
+        info = PngInfo()
+        info.add_text(ATLAS_KEY, json.dumps({'version': ATLAS_VERSION, 'size': self.size, 'icons': self.entries}))
+        try:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            temp_path = self.path + ".tmp"
+            self.atlas.save(temp_path, "PNG", pnginfo=info)
+            os.replace(temp_path, self.path)
+        except OSError as e:
+            print(f"Cannot write icon atlas: {e}")
+
+    def update(self, icons):
+        """Make atlas hold exactly icons ({icon path: mtime}), decoding only new or changed ones"""
+        kept = {path: entry for path, entry in self.entries.items()
+                if icons.get(path) is not None and icons[path] == entry['mtime']}
+        if len(kept) == len(icons) == len(self.entries):
+            return
+
+        # Repack: cached icons are copied over, the others are rendered from their files
+        rows = max(1, (len(icons) + ATLAS_COLUMNS - 1) // ATLAS_COLUMNS)
+        atlas = Image.new('RGBA', (ATLAS_COLUMNS * self.size, rows * self.size))
+        entries = {}
+        for slot, path in enumerate(sorted(icons)):
+            if path in kept and kept[path]['slot'] is None:
+                entries[path] = kept[path]
+                continue
+            try:
+                if path in kept:
+                    icon_image = self.atlas.crop(get_slot_box(kept[path]['slot'], self.size))
+                else:
+                    icon_image = render_icon(path, self.size)
+            except Exception as e:
+                # Remember broken icons too, so they are not decoded again on every start
+                print(f"Cannot load icon {path}: {e}")
+                entries[path] = {'mtime': icons[path], 'slot': None}
+                continue
+            atlas.paste(icon_image, get_slot_box(slot, self.size))
+            entries[path] = {'mtime': icons[path], 'slot': slot}
+
+        self.atlas = atlas
+        self.entries = entries
+        self.save()
+
+    def get(self, icon_path):
+        """Get cached icon as RGBA image, None if the atlas does not hold it"""
+        entry = self.entries.get(icon_path)
+        if entry is None or entry['slot'] is None or self.atlas is None:
+            return None
+        return self.atlas.crop(get_slot_box(entry['slot'], self.size))
@@ -0,0 +1,175 @@
+"""
+Single-instance support for Openpix
+
+The first Openpix window listens on a local socket and records its port
+and a random token in the cache directory. A later python app.py <image>
+finds it there, sends the image path and exits before importing the GUI,
+so opening files one after another reuses one window (and one temp
+directory and edit history).
+
+The client side runs before anything else is imported, so the instance
+file and the request are plain text lines rather than JSON.
+
+Windows that do run side by side (--new-instance, or options that need
+a process of their own) each keep their hand-off files and spilled edit
+history in their own session directory below temp/.
+"""
+
+import os
+import sys
+import socket
+
+CACHE_DIR = "cache"
+INSTANCE_FILE = "instance.txt"
+CONNECT_TIMEOUT = 0.5
+
+def get_instance_path(cache_dir=CACHE_DIR):
+    """Get path of file describing the running instance"""
+    return os.path.join(cache_dir, INSTANCE_FILE)
+
+def send_to_running_instance(image_path, cache_dir=CACHE_DIR):
+    """Ask running instance to open image_path (or just come to front for None), True if it accepted"""
+    try:
+        # port, token, pid
+        with open(get_instance_path(cache_dir), encoding="utf-8") as f:
+            port, token = f.read().split()[:2]
+        request = f"{token}\t{os.path.abspath(image_path) if image_path else ''}\n"
+        with socket.create_connection(("127.0.0.1", int(port)), timeout=CONNECT_TIMEOUT) as connection:
+            connection.sendall(request.encode("utf-8"))
+            return connection.makefile("rb").readline().strip() == b"ok"
+    except (OSError, ValueError):
+        # No instance, or a stale file left by one that exited
+        return False
+
+def forward_arguments(argv, cache_dir=CACHE_DIR):
+    """Hand command line to a running instance unless it asks for something else, True if handed over"""
+    if argv and argv[0] == "batch":
+        return False
+    if any(arg.startswith("-") for arg in argv) or len(argv) > 1:
+        # Options like --new-instance, --trace or --help need a process of their own
+        return False
+    return send_to_running_instance(argv[0] if argv else None, cache_dir)
+
+def is_process_alive(pid):
+    """Check if process pid is still running"""
+    if sys.platform == "win32":
+        import ctypes
+        # PROCESS_QUERY_LIMITED_INFORMATION; signal 0 would terminate the process on Windows
+        handle = ctypes.windll.kernel32.OpenProcess(0x1000, False, pid)
+        if not handle:
+            # Access denied means it exists
+            return ctypes.windll.kernel32.GetLastError() == 5
+        try:
+            exit_code = ctypes.c_ulong()
+            ctypes.windll.kernel32.GetExitCodeProcess(handle, ctypes.byref(exit_code))
+            # STILL_ACTIVE
+            return exit_code.value == 259
+        finally:
+            ctypes.windll.kernel32.CloseHandle(handle)
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except OSError:
+        # Exists, but belongs to another user
+        return True
+    return True
+
+def create_session_dir(temp_root):
+    """Create temp directory of this process, named <pid>-<token>, returns its path"""
+    import secrets
+    path = os.path.join(temp_root, f"{os.getpid()}-{secrets.token_hex(4)}")
+    os.makedirs(path)
+    return path
+
+def remove_stale_session_dirs(temp_root):
+    """Remove session directories of processes that are no longer running"""
+    import shutil
+    for name in os.listdir(temp_root):
+        path = os.path.join(temp_root, name)
+        pid = name.split("-", 1)[0]
+        if not os.path.isdir(path) or not pid.isdigit() or int(pid) == os.getpid():
+            continue
+        if not is_process_alive(int(pid)):
+            shutil.rmtree(path, ignore_errors=True)
+
+class InstanceServer:
+    """Accept open requests from later invocations
+
+    Requests arrive on a background thread and are queued; the GUI takes
+    them with get_requests from its event loop.
+    """
+    def __init__(self, cache_dir=CACHE_DIR):
+        import queue
+        import secrets
+        self.path = get_instance_path(cache_dir)
+        self.token = secrets.token_hex(16)
+        self.requests = queue.Queue()
+        self.socket = None
+
+    def start(self):
+        """Listen on a local port and publish it, returns False if that is not possible"""
+        try:
+            self.socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+            self.socket.bind(("127.0.0.1", 0))
+            self.socket.listen()
+
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            temp_path = f"{self.path}.{os.getpid()}.tmp"
+            with open(temp_path, "w", encoding="utf-8") as f:
+                f.write(f"{self.socket.getsockname()[1]} {self.token} {os.getpid()}\n")
+            os.replace(temp_path, self.path)
+        except OSError as e:
+            print(f"Cannot start single-instance server: {e}")
+            return False
+
+        import atexit
+        import threading
+        atexit.register(self.close)
+        threading.Thread(target=self.serve, daemon=True).start()
+        return True
+
+    def serve(self):
+        """Accept connections until the socket is closed"""
+        server = self.socket
+        while True:
+            try:
+                connection, address = server.accept()
+            except OSError:
+                break
+            with connection:
+                try:
+                    connection.settimeout(CONNECT_TIMEOUT)
+                    token, image_path = connection.makefile("rb").readline().decode("utf-8").rstrip("\n").split("\t", 1)
+                    if not self.check_token(token):
+                        connection.sendall(b"denied\n")
+                        continue
+                    self.requests.put(image_path or None)
+                    connection.sendall(b"ok\n")
+                except (OSError, ValueError) as e:
+                    print(f"Ignoring bad instance request: {e}")
+
+    def check_token(self, token):
+        """Check request token in constant time"""
+        import secrets
+        return secrets.compare_digest(token.encode("utf-8"), self.token.encode("utf-8"))
+
+    def get_requests(self):
+        """Get image paths (None to just come to front) requested since the last call"""
+        requests = []
+        while not self.requests.empty():
+            requests.append(self.requests.get())
+        return requests
+
+    def close(self):
+        """Stop listening and remove the instance file if it is still ours"""
+        if self.socket:
+            self.socket.close()
+            self.socket = None
+        try:
+            with open(self.path, encoding="utf-8") as f:
+                ours = self.token in f.read().split()
+            if ours:
+                os.remove(self.path)
+        except OSError:
+            pass
@@ -0,0 +1,147 @@
+"""
+Edit macros for Openpix
+
+A macro is the ordered chain of modules applied in an editing session,
+saved as a small JSON file and replayed on other images, in the editor
+or with python app.py batch --macro.
+
+Before replay the chain is compiled into stages: consecutive modules
+exporting process(image) are fused into one stage that runs them back
+to back on the in-memory image, so only script modules pay for a file
+hand-off.
+"""
+
+import os
+import glob
+import json
+from plugins import get_plugin, get_module_info, get_module_modes, convert_for_module, run_plugin
+from pixelbuffer import PIXEL_BUFFER_EXTENSION, open_image, save_image
+from workers import run_script, close_tk_windows
+
+MODULES_DIR = "modules"
+MACRO_EXTENSION = ".json"
+MACRO_FORMAT = "openpix-macro"
+MACRO_VERSION = 1
+
+def resolve_module(name, modules_dir=MODULES_DIR):
+    """Find module script by path, path below modules_dir or file name"""
+    candidates = [name, os.path.join(modules_dir, name)]
+    if not name.endswith(".py"):
+        candidates += [name + ".py", os.path.join(modules_dir, name + ".py")]
+    for candidate in candidates:
+        if os.path.isfile(candidate):
+            return os.path.abspath(candidate)
+
+    # Fall back to searching the module tree by file name
+    filename = os.path.basename(name)
+    if not filename.endswith(".py"):
+        filename += ".py"
+    matches = sorted(glob.glob(os.path.join(modules_dir, "**", filename), recursive=True))
+    if len(matches) == 1:
+        return os.path.abspath(matches[0])
+    if matches:
+        raise ValueError(f"Module name {name} is ambiguous: {', '.join(matches)}")
+    raise ValueError(f"Module not found: {name}")
+
+def get_recorded_modules(details):
+    """Get module chain from edit history details, oldest first"""
+    modules = []
+    for detail in details:
+        if 'modules' in detail:
+            # State produced by replaying a macro
+            modules.extend(detail['modules'])
+        elif 'module' in detail:
+            modules.append(detail['module'])
+    return modules
+
+def save_macro(path, module_paths, modules_dir=MODULES_DIR):
+    """Write module chain as macro file, modules below modules_dir are stored relative to it"""
+    root = os.path.abspath(modules_dir)
+    names = []
+    for module_path in module_paths:
+        module_path = os.path.abspath(module_path)
+        relative = os.path.relpath(module_path, root)
+        names.append(module_path if relative.startswith("..") else relative.replace(os.sep, "/"))
+
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump({'format': MACRO_FORMAT, 'version': MACRO_VERSION, 'modules': names}, f, indent=2)
+
+def load_macro(path, modules_dir=MODULES_DIR):
+    """Read macro file, returns list of module paths"""
+    with open(path, encoding="utf-8") as f:
+        macro = json.load(f)
+
+    if not isinstance(macro, dict) or macro.get('format') != MACRO_FORMAT:
+        raise ValueError(f"{path} is not an Openpix macro")
+    if macro.get('version', 0) > MACRO_VERSION:
+        raise ValueError(f"{path} needs a newer Openpix (macro version {macro['version']})")
+    return [resolve_module(name, modules_dir) for name in macro.get('modules', [])]
+
+def compile_chain(module_paths):
+    """Group module chain into stages, fusing consecutive in-process modules"""
+    stages = []
+    for module_path in module_paths:
+        plugin = get_plugin(module_path)
+        if plugin is None:
+            stages.append({'modules': [module_path], 'plugins': None})
+            continue
+
+        step = (plugin, get_module_modes(module_path))
+        if stages and stages[-1]['plugins'] is not None:
+            stages[-1]['modules'].append(module_path)
+            stages[-1]['plugins'].append(step)
+        else:
+            stages.append({'modules': [module_path], 'plugins': [step]})
+    return stages
+
+def run_script_in_process(module_path, args):
+    """Run module script in this interpreter, returns (returncode, stdout, stderr)"""
+    result = run_script(module_path, args)
+    close_tk_windows()
+    return result
+
+def run_fused_stage(image, stage):
+    """Run in-process modules of stage back to back, returns None if one produced no image"""
+    for plugin, modes in stage['plugins']:
+        image = run_plugin(plugin, convert_for_module(image, modes))
+        if image is None:
+            return None
+    return image
+
+def run_script_stage(image, stage, work_dir, step, script_runner):
+    """Run script module of stage through a file hand-off, returns None if it produced no image"""
+    module_path = stage['modules'][0]
+    image = convert_for_module(image, get_module_modes(module_path))
+
+    # Every step gets its own files, earlier outputs may still be mapped
+    extension = PIXEL_BUFFER_EXTENSION if get_module_info(module_path).get('pixel_buffer') else ".tif"
+    input_path = os.path.join(work_dir, f"input{step}{extension}")
+    output_path = os.path.join(work_dir, f"output{step}{extension}")
+    save_image(image, input_path)
+
+    returncode, stdout, stderr = script_runner(module_path, ["-i", input_path, "-o", output_path])
+    if returncode != 0:
+        raise RuntimeError(stderr.strip() or stdout.strip() or f"exit code {returncode}")
+    if not os.path.exists(output_path):
+        return None
+    return open_image(output_path)
+
+def run_chain(image, stages, work_dir, script_runner=run_script_in_process):
+    """Run compiled stages on image, returns the result or None if a module produced no image
+
+    Script stages write their files to work_dir; the result never refers
+    to them, so the caller can remove work_dir afterwards.
+    """
+    output = None
+    for step, stage in enumerate(stages):
+        if stage['plugins'] is not None:
+            image = run_fused_stage(image, stage)
+        else:
+            image = output = run_script_stage(image, stage, work_dir, step, script_runner)
+        if image is None:
+            return None
+
+    if image is output:
+        # Detach result from the output file, in-process modules may hand it back unchanged
+        image = image.copy()
+    return image
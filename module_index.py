@@ -0,0 +1,177 @@
+"""
+Persistent index of the modules directory for Openpix
+
+Scanning a large module tree on every start walks every directory and
+parses every module. The index keeps what a scan found (sub-directories,
+module files, their metadata and which icons exist) in a JSON file in the
+cache directory, keyed by directory modification times. A later scan
+stats each directory once and only re-reads the ones whose listing
+changed, so start-up cost does not grow with the number of modules.
+
+Module metadata is refreshed when a file is added, removed or renamed in
+its directory. Icon files are stat'ed on every scan instead, an icon
+overwritten in place does not change its directory. Running a module always reads its current options, see
+plugins.get_module_info.
+"""
+
+import os
+import json
+from plugins import read_module_info
+
+CACHE_DIR = "cache"
+INDEX_FILE = "module_index.json"
+INDEX_VERSION = 2
+
+def get_display_name(module_name):
+    """Get name shown for module file"""
+    return module_name.replace(".py", "").replace("-", " ")
+
+class ModuleIndex:
+    """Module tree of a modules directory, cached on disk between runs"""
+    def __init__(self, modules_dir, icons_dir, cache_dir=CACHE_DIR):
+        self.modules_dir = modules_dir
+        self.icons_dir = icons_dir
+        self.cache_path = os.path.join(cache_dir, INDEX_FILE)
+
+        # Directory path -> {'mtime', 'dirs', 'files': {name: {'mtime', 'info'}}}
+        self.directories = {}
+        self.icons = {'mtime': None, 'files': {}}
+        self.changed = False
+        self.load()
+
+    def load(self):
+        """Read index file, starting empty if it is missing or outdated"""
+        try:
+            with open(self.cache_path, encoding="utf-8") as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            return
+
+        if data.get('version') != INDEX_VERSION or data.get('modules_dir') != os.path.abspath(self.modules_dir):
+            return
+        self.directories = data.get('directories', {})
+        self.icons = data.get('icons', self.icons)
+
+    def save(self):
+        """Write index file if the last scan changed it"""
+        if not self.changed:
+            return
+        data = {
+            'version': INDEX_VERSION,
+            'modules_dir': os.path.abspath(self.modules_dir),
+            'directories': self.directories,
+            'icons': self.icons
+        }
+        try:
+            os.makedirs(os.path.dirname(self.cache_path), exist_ok=True)
+            temp_path = self.cache_path + ".tmp"
+            with open(temp_path, "w", encoding="utf-8") as f:
+                json.dump(data, f, default=str)
+            os.replace(temp_path, self.cache_path)
+            self.changed = False
+        except OSError as e:
+            print(f"Cannot write module index: {e}")
+
+    def scan(self):
+        """Bring index up to date with the disk, returns the module tree"""
+        self.update_icons()
+        seen = set()
+        tree = self.scan_directory(self.modules_dir, seen)
+
+        # Forget directories that no longer exist
+        for path in list(self.directories):
+            if path not in seen:
+                del self.directories[path]
+                self.changed = True
+
+        self.save()
+        return tree or {'name': os.path.basename(self.modules_dir), 'path': self.modules_dir,
+                        'groups': [], 'modules': []}
+
+    def update_icons(self):
+        """Re-list icons directory, picking up icons added, removed or overwritten"""
+        try:
+            mtime = os.stat(self.icons_dir).st_mtime_ns
+        except OSError:
+            mtime = None
+
+        # Icon file name -> mtime, so the icon atlas can tell stale icons without a stat
+        files = {}
+        if mtime is not None:
+            for entry in os.scandir(self.icons_dir):
+                if entry.name.endswith(".png"):
+                    files[entry.name] = entry.stat().st_mtime_ns
+        if mtime == self.icons['mtime'] and files == self.icons['files']:
+            return
+        self.icons = {'mtime': mtime, 'files': files}
+        self.changed = True
+
+    def scan_directory(self, directory, seen):
+        """Build tree node of directory, or None if it holds no modules"""
+        try:
+            mtime = os.stat(directory).st_mtime_ns
+        except OSError:
+            return None
+
+        entry = self.directories.get(directory)
+        if entry is None or entry['mtime'] != mtime:
+            entry = self.read_directory(directory, mtime, entry)
+            self.directories[directory] = entry
+            self.changed = True
+        seen.add(directory)
+
+        groups = []
+        for name in entry['dirs']:
+            group = self.scan_directory(os.path.join(directory, name), seen)
+            if group:
+                groups.append(group)
+
+        icons = self.icons['files']
+        modules = []
+        for name in sorted(entry['files']):
+            icon_name = f"{name}.png"
+            modules.append({
+                'name': get_display_name(name),
+                'path': os.path.join(directory, name),
+                'icon_path': os.path.join(self.icons_dir, icon_name) if icon_name in icons else None,
+                'icon_mtime': icons.get(icon_name),
+                'info': entry['files'][name]['info']
+            })
+
+        if not groups and not modules:
+            return None
+        return {'name': os.path.basename(directory), 'path': directory, 'groups': groups, 'modules': modules}
+
+    def read_directory(self, directory, mtime, previous=None):
+        """List directory, re-reading metadata only of module files that changed"""
+        old_files = previous['files'] if previous else {}
+        dirs = []
+        files = {}
+        for item in os.scandir(directory):
+            if item.is_dir():
+                dirs.append(item.name)
+            elif item.name.endswith(".py"):
+                file_mtime = item.stat().st_mtime_ns
+                old = old_files.get(item.name)
+                if old and old['mtime'] == file_mtime:
+                    files[item.name] = old
+                else:
+                    files[item.name] = {'mtime': file_mtime, 'info': self.read_info(item.path)}
+
+        return {'mtime': mtime, 'dirs': sorted(dirs), 'files': files}
+
+    def read_info(self, module_path):
+        """Read module metadata, empty for modules that cannot be parsed"""
+        try:
+            return read_module_info(module_path)
+        except Exception as e:
+            print(f"Cannot read module {module_path}: {e}")
+            return {'description': "", 'in_process': False}
+
+def iter_modules(tree):
+    """Yield (module, group names) for all modules of tree, groups before modules"""
+    for group in tree['groups']:
+        for module, groups in iter_modules(group):
+            yield module, [group['name']] + groups
+    for module in tree['modules']:
+        yield module, []
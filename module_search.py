@@ -0,0 +1,127 @@
+"""
+Module search for Openpix
+
+The index is built once per module scan. Every distinct word of module
+names, group names and descriptions goes into a vocabulary indexed by
+its character trigrams; a query word looks up the vocabulary words
+sharing a trigram with it and scores them (exact, prefix, substring or
+fuzzy match). A module matches when every query word matches one of its
+words, and is ranked by how well and in which field it matched: names
+count more than groups, groups more than descriptions.
+"""
+
+import re
+from collections import Counter
+
+# Weight of a match by field
+FIELD_WEIGHTS = {'name': 3.0, 'group': 2.0, 'description': 1.0}
+
+# Word similarity by match kind
+EXACT_SCORE = 1.0
+PREFIX_SCORE = 0.9
+SUBSTRING_SCORE = 0.7
+FUZZY_SCORE = 0.6
+
+# Minimum trigram similarity for a fuzzy match
+MIN_SIMILARITY = 0.4
+
+WORD_PATTERN = re.compile(r"\w+")
+
+def split_words(text):
+    """Get lowercase words of text"""
+    return WORD_PATTERN.findall(text.lower())
+
+def get_trigrams(word):
+    """Get set of character trigrams of word, padded so prefixes get their own trigrams"""
+    padded = f"  {word} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+class ModuleSearchIndex:
+    """Ranked fuzzy search over module names, groups and descriptions"""
+    def __init__(self, modules):
+        # modules: iterable of (module, group names) as yielded by module_index.iter_modules
+        self.modules = []
+        self.words = []
+        self.word_ids = {}
+        self.word_trigrams = []
+        self.postings = []
+        self.trigram_index = {}
+
+        for module, groups in modules:
+            module_id = len(self.modules)
+            self.modules.append(module)
+            self.add_text(module_id, module['name'], 'name')
+            self.add_text(module_id, " ".join(groups), 'group')
+            self.add_text(module_id, module.get('info', {}).get('description', ""), 'description')
+
+    def add_text(self, module_id, text, field):
+        """Index words of text for module"""
+        weight = FIELD_WEIGHTS[field]
+        for word in split_words(text):
+            word_id = self.word_ids.get(word)
+            if word_id is None:
+                word_id = len(self.words)
+                self.word_ids[word] = word_id
+                self.words.append(word)
+                self.postings.append({})
+                trigrams = get_trigrams(word)
+                self.word_trigrams.append(trigrams)
+                for trigram in trigrams:
+                    self.trigram_index.setdefault(trigram, []).append(word_id)
+
+            # Keep the best field a word occurs in
+            posting = self.postings[word_id]
+            if posting.get(module_id, 0) < weight:
+                posting[module_id] = weight
+
+    def match_word(self, token):
+        """Get {word id: similarity} of vocabulary words matching query word"""
+        token_trigrams = get_trigrams(token)
+        shared = Counter()
+        for trigram in token_trigrams:
+            shared.update(self.trigram_index.get(trigram, ()))
+
+        matches = {}
+        for word_id, count in shared.items():
+            word = self.words[word_id]
+            if word == token:
+                matches[word_id] = EXACT_SCORE
+            elif word.startswith(token):
+                matches[word_id] = PREFIX_SCORE
+            elif token in word:
+                matches[word_id] = SUBSTRING_SCORE
+            else:
+                # Dice coefficient of trigram sets, tolerates typos
+                similarity = 2 * count / (len(token_trigrams) + len(self.word_trigrams[word_id]))
+                if similarity >= MIN_SIMILARITY:
+                    matches[word_id] = FUZZY_SCORE * similarity
+        return matches
+
+    def search(self, text, limit=None):
+        """Get modules matching every word of text, best first"""
+        tokens = split_words(text)
+        if not tokens:
+            return list(self.modules)
+
+        scores = None
+        for token in tokens:
+            token_scores = {}
+            for word_id, similarity in self.match_word(token).items():
+                for module_id, weight in self.postings[word_id].items():
+                    score = similarity * weight
+                    if token_scores.get(module_id, 0) < score:
+                        token_scores[module_id] = score
+
+            if scores is None:
+                scores = token_scores
+            else:
+                # Every query word has to match
+                scores = {module_id: score + token_scores[module_id]
+                          for module_id, score in scores.items() if module_id in token_scores}
+            if not scores:
+                return []
+
+        ranked = sorted(scores, key=lambda module_id: (-scores[module_id], self.modules[module_id]['name'].lower()))
+        if limit is not None:
+            ranked = ranked[:limit]
+        return [self.modules[module_id] for module_id in ranked]
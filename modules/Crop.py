@@ -7,18 +7,206 @@ Usage: python crop.py -i <input_image_path> -o <output_image_path>
 import argparse
 import sys
 import os
-from PIL import Image, ImageTk
+from PIL import Image, ImageTk, ImageColor
 import customtkinter as ctk
 import tkinter as tk
 from tkinter import messagebox
 import math
+import threading
+
+# Raw pixel hand-off with Openpix, not needed when run standalone
+try:
+    from pixelbuffer import open_image, save_image, is_pixel_buffer
+except ImportError:
+    open_image = None
+
+# Openpix passes -i/-o as pixel buffer files
+OPENPIX_PIXEL_BUFFER = True
+
+# Image modes handled without conversion, Openpix converts others first
+OPENPIX_MODES = ('RGB', 'RGBA', 'L', 'LA')
+
+# Preview levels are at most twice the display size, so bilinear sampling is enough
+PREVIEW_RESAMPLE = Image.Resampling.BILINEAR
+
+# Resampling of the single full resolution transform on Done
+FINAL_RESAMPLE = Image.Resampling.BICUBIC
+
+# Delay of coalesced display updates while the window is resized, about one frame
+DISPLAY_DELAY_MS = 16
+
+# Output to input pixel mapping of every transpose, as affine matrix of the input size
+TRANSPOSE_MATRICES = {
+    Image.Transpose.FLIP_LEFT_RIGHT: lambda w, h: (-1, 0, w, 0, 1, 0),
+    Image.Transpose.FLIP_TOP_BOTTOM: lambda w, h: (1, 0, 0, 0, -1, h),
+    Image.Transpose.ROTATE_90: lambda w, h: (0, -1, w, 1, 0, 0),
+    Image.Transpose.ROTATE_180: lambda w, h: (-1, 0, w, 0, -1, h),
+    Image.Transpose.ROTATE_270: lambda w, h: (0, 1, 0, -1, 0, h),
+    Image.Transpose.TRANSPOSE: lambda w, h: (0, 1, 0, 1, 0, 0),
+    Image.Transpose.TRANSVERSE: lambda w, h: (0, -1, w, -1, 0, h)
+}
+
+def compose(outer, inner):
+    """Get affine matrix applying inner first, then outer (both map output to input)"""
+    a, b, c, d, e, f = outer
+    g, h, i, j, k, l = inner
+    return (g * a + j * b, h * a + k * b, i * a + l * b + c,
+            g * d + j * e, h * d + k * e, i * d + l * e + f)
+
+def invert(matrix):
+    """Get inverse of affine matrix"""
+    a, b, c, d, e, f = matrix
+    det = a * e - b * d
+    return (e / det, -b / det, (b * f - c * e) / det,
+            -d / det, a / det, (c * d - a * f) / det)
+
+def get_transposed_size(size, method):
+    """Get image size after transpose method"""
+    width, height = size
+    if method in (Image.Transpose.FLIP_LEFT_RIGHT, Image.Transpose.FLIP_TOP_BOTTOM, Image.Transpose.ROTATE_180):
+        return width, height
+    return height, width
+
+def get_rotation(size, angle):
+    """Get (matrix, size) of Image.rotate(angle, expand=True) on an image of size"""
+    angle = angle % 360.0
+    if angle == 0:
+        return (1, 0, 0, 0, 1, 0), size
+    if angle in (90, 180, 270):
+        # Same exact paths as Image.rotate
+        method = {90: Image.Transpose.ROTATE_90, 180: Image.Transpose.ROTATE_180,
+                  270: Image.Transpose.ROTATE_270}[angle]
+        return TRANSPOSE_MATRICES[method](*size), get_transposed_size(size, method)
+
+    # Rotation about the center, grown to the bounding box of the rotated corners
+    width, height = size
+    radians = -math.radians(angle)
+    cos = round(math.cos(radians), 15)
+    sin = round(math.sin(radians), 15)
+    matrix = (cos, sin, width / 2 - cos * width / 2 - sin * height / 2,
+              -sin, cos, height / 2 + sin * width / 2 - cos * height / 2)
+    corners = [(matrix[0] * x + matrix[1] * y + matrix[2], matrix[3] * x + matrix[4] * y + matrix[5])
+               for x, y in ((0, 0), (width, 0), (width, height), (0, height))]
+    new_width = math.ceil(max(x for x, y in corners)) - math.floor(min(x for x, y in corners))
+    new_height = math.ceil(max(y for x, y in corners)) - math.floor(min(y for x, y in corners))
+    shift = (1, 0, -(new_width - width) / 2, 0, 1, -(new_height - height) / 2)
+    return compose(matrix, shift), (new_width, new_height)
+
+class ImageTransform:
+    """Rotations, mirrors and crops of an image, composed into one affine matrix
+
+    The matrix maps output pixel coordinates to original image coordinates,
+    the way Image.transform takes it. Every operation returns a new
+    transform, so renders can tell which state they show.
+    """
+    def __init__(self, size, matrix=(1, 0, 0, 0, 1, 0)):
+        self.size = size
+        self.matrix = matrix
+
+    def then(self, matrix, size):
+        """Get transform followed by a step mapping size output to the current output"""
+        return ImageTransform(size, compose(self.matrix, matrix))
+
+    def rotate(self, angle):
+        """Get transform followed by a counter-clockwise rotation, expanding the canvas"""
+        return self.then(*get_rotation(self.size, angle))
+
+    def transpose(self, method):
+        """Get transform followed by a flip or 90 degree rotation"""
+        return self.then(TRANSPOSE_MATRICES[method](*self.size), get_transposed_size(self.size, method))
+
+    def crop(self, box):
+        """Get transform followed by a crop to box in output coordinates"""
+        left, top, right, bottom = box
+        return self.then((1, 0, left, 0, 1, top), (right - left, bottom - top))
+
+    def get_exact(self, image_size):
+        """Get (transpose method or None, crop box) giving the same result without resampling, None if there is none"""
+        values = [round(value) for value in self.matrix]
+        if any(abs(value - exact) > 1e-6 for value, exact in zip(self.matrix, values)):
+            return None
+
+        for method in [None] + list(TRANSPOSE_MATRICES):
+            if method is None:
+                transposed_size = image_size
+                remaining = tuple(values)
+            else:
+                transposed_size = get_transposed_size(image_size, method)
+                remaining = compose(invert(TRANSPOSE_MATRICES[method](*image_size)), values)
+            if [round(value) for value in (remaining[0], remaining[1], remaining[3], remaining[4])] != [1, 0, 0, 1]:
+                continue
+            left, top = round(remaining[2]), round(remaining[5])
+            box = (left, top, left + self.size[0], top + self.size[1])
+            if left < 0 or top < 0 or box[2] > transposed_size[0] or box[3] > transposed_size[1]:
+                # Reaches into filled corners, left to the transform
+                return None
+            return method, box
+        return None
+
+    def apply(self, image, fillcolor=None):
+        """Transform image at full resolution, resampling at most once"""
+        exact = self.get_exact(image.size)
+        if exact:
+            method, box = exact
+            if method is not None:
+                image = image.transpose(method)
+            if box == (0, 0) + image.size:
+                return image.copy() if method is None else image
+            return image.crop(box)
+        return image.transform(self.size, Image.Transform.AFFINE, self.matrix, FINAL_RESAMPLE, fillcolor=fillcolor)
+
+    def render(self, source, source_scale, display_size, fillcolor=None):
+        """Draw output at display_size from source, the original image scaled by (scale_x, scale_y)"""
+        display = (self.size[0] / display_size[0], 0, 0, 0, self.size[1] / display_size[1], 0)
+        scale = (source_scale[0], 0, 0, 0, source_scale[1], 0)
+        matrix = compose(scale, compose(self.matrix, display))
+        return source.transform(display_size, Image.Transform.AFFINE, matrix, PREVIEW_RESAMPLE, fillcolor=fillcolor)
+
+class PreviewPyramid:
+    """Halved copies of the original image, the preview is drawn from the closest one"""
+    def __init__(self, image):
+        self.levels = [image]
+
+    def get_source(self, scale):
+        """Get (level image, (scale_x, scale_y)) to draw the original at scale from"""
+        original = self.levels[0]
+        index = 0
+        while scale * 2 ** (index + 1) <= 1 and min(self.levels[index].size) >= 4:
+            index += 1
+            if index == len(self.levels):
+                self.levels.append(self.levels[-1].reduce(2))
+        level = self.levels[index]
+        return level, (level.width / original.width, level.height / original.height)
+
+class DisplayProxy:
+    """Preview of the current transform at screen size, only resized when the canvas changes"""
+    def __init__(self, pyramid, fillcolor=None):
+        self.pyramid = pyramid
+        self.fillcolor = fillcolor
+        self.transform = None
+        self.image = None
+
+    def get_image(self, transform, display_size, proxy_scale):
+        """Get preview of transform at display_size, redrawing the proxy at proxy_scale if needed"""
+        if (transform is not self.transform or self.image.width < display_size[0]
+                or self.image.height < display_size[1]):
+            proxy_scale = max(proxy_scale, display_size[0] / transform.size[0], display_size[1] / transform.size[1])
+            size = (max(1, round(transform.size[0] * proxy_scale)), max(1, round(transform.size[1] * proxy_scale)))
+            source, source_scale = self.pyramid.get_source(proxy_scale)
+            self.image = transform.render(source, source_scale, size, self.fillcolor)
+            self.transform = transform
+        if self.image.size == display_size:
+            return self.image
+        return self.image.resize(display_size, Image.Resampling.BILINEAR)
 
 class ImageCropTool:
     def __init__(self, input_path, output_path):
         self.input_path = input_path
         self.output_path = output_path
         self.original_image = None
-        self.current_image = None
+        self.proxy = None
+        self.transform = None
+        self.fillcolor = None
         self.display_image = None
         self.photo = None
         self.canvas_width = 800
@@ -33,6 +221,18 @@ class ImageCropTool:
         self.crop_rect = None
         self.is_cropping = False
         
+        # Background display rendering
+        self.render_condition = threading.Condition()
+        self.render_request = None
+        self.render_result = None
+        self.render_generation = 0
+        self.poll_job = None
+        self.display_job = None
+        self.display_request = None
+        self.display_source = None
+        self.display_image = None
+        threading.Thread(target=self.render_worker, daemon=True).start()
+        
         # Initialize GUI
         self.setup_gui()
         self.load_image()
@@ -133,8 +333,14 @@ class ImageCropTool:
     def load_image(self):
         """Load the input image"""
         try:
-            self.original_image = Image.open(self.input_path)
-            self.current_image = self.original_image.copy()
+            if open_image:
+                self.original_image = open_image(self.input_path)
+            else:
+                self.original_image = Image.open(self.input_path)
+            self.transform = ImageTransform(self.original_image.size)
+            # Fill uncovered corners with transparent white, or white without alpha
+            self.fillcolor = ImageColor.getcolor("#ffffff00", self.original_image.mode)
+            self.proxy = DisplayProxy(PreviewPyramid(self.original_image), self.fillcolor)
             self.update_display()
         except Exception as e:
             messagebox.showerror("Error", f"Failed to load image: {str(e)}")
@@ -142,7 +348,8 @@ class ImageCropTool:
             
     def update_display(self):
         """Update the canvas with the current image"""
-        if self.current_image is None:
+        self.display_job = None
+        if self.transform is None:
             return
             
         # Calculate scale factor to fit image in canvas
@@ -150,28 +357,82 @@ class ImageCropTool:
         canvas_height = self.canvas.winfo_height()
         
         if canvas_width <= 1 or canvas_height <= 1:
-            self.root.after(100, self.update_display)
+            self.display_job = self.root.after(100, self.update_display)
             return
             
-        img_width, img_height = self.current_image.size
+        img_width, img_height = self.transform.size
         
         scale_x = canvas_width / img_width
         scale_y = canvas_height / img_height
-        self.scale_factor = min(scale_x, scale_y, 1.0)  # Don't scale up
+        scale_factor = min(scale_x, scale_y, 1.0)  # Don't scale up
         
-        # Resize image for display
-        display_width = int(img_width * self.scale_factor)
-        display_height = int(img_height * self.scale_factor)
+        # Draw preview on the render thread, newer requests supersede older ones
+        display_width = max(1, int(img_width * scale_factor))
+        display_height = max(1, int(img_height * scale_factor))
         
-        self.display_image = self.current_image.resize((display_width, display_height), Image.Resampling.LANCZOS)
-        self.photo = ImageTk.PhotoImage(self.display_image)
+        # Moving the window or a resize back and forth changes nothing
+        if self.display_request == (self.transform, (display_width, display_height)):
+            return
+        self.display_request = (self.transform, (display_width, display_height))
         
-        # Clear canvas and display image
-        self.canvas.delete("all")
-        self.canvas.create_image(canvas_width // 2, canvas_height // 2, image=self.photo, anchor="center")
+        # The proxy covers the screen, so later resizes only scale it
+        proxy_scale = min(self.root.winfo_screenwidth() / img_width, self.root.winfo_screenheight() / img_height, 1.0)
         
-        # Update scroll region
-        self.canvas.configure(scrollregion=self.canvas.bbox("all"))
+        with self.render_condition:
+            self.render_generation += 1
+            self.render_request = (self.render_generation, self.transform, scale_factor,
+                                   (display_width, display_height), proxy_scale)
+            self.render_condition.notify()
+            
+        if not self.poll_job:
+            self.poll_job = self.root.after(15, self.poll_render_result)
+            
+    def render_worker(self):
+        """Draw previews from the display proxy off the Tk main thread"""
+        while True:
+            with self.render_condition:
+                while self.render_request is None:
+                    self.render_condition.wait()
+                generation, transform, scale_factor, size, proxy_scale = self.render_request
+                self.render_request = None
+                
+            try:
+                display_image = self.proxy.get_image(transform, size, proxy_scale)
+            except Exception as e:
+                print(f"Error rendering display: {e}")
+                display_image = None
+                
+            with self.render_condition:
+                # Stale renders never reach the canvas
+                if generation == self.render_generation:
+                    self.render_result = (generation, transform, scale_factor, display_image)
+                    
+    def poll_render_result(self):
+        """Swap in the rendered display image on the Tk thread"""
+        with self.render_condition:
+            result = self.render_result
+            self.render_result = None
+            pending = result is None or result[0] != self.render_generation
+            
+        if result and result[3] is not None:
+            generation, self.display_source, self.scale_factor, self.display_image = result
+            self.photo = ImageTk.PhotoImage(self.display_image)
+            
+            # Clear canvas and display image
+            canvas_width = self.canvas.winfo_width()
+            canvas_height = self.canvas.winfo_height()
+            self.canvas.delete("all")
+            self.crop_rect = None
+            self.canvas.create_image(canvas_width // 2, canvas_height // 2, image=self.photo, anchor="center")
+            
+            # Update scroll region
+            self.canvas.configure(scrollregion=self.canvas.bbox("all"))
+            
+        elif result and result[0] == self.render_generation:
+            # Render failed, let the next scheduled update submit the same request again
+            self.display_request = None
+            
+        self.poll_job = self.root.after(15, self.poll_render_result) if pending else None
         
     def start_crop(self, event):
         """Start cropping selection"""
@@ -209,6 +470,10 @@ class ImageCropTool:
             messagebox.showwarning("Warning", "Please select an area to crop first")
             return
             
+        if self.display_source is not self.transform:
+            messagebox.showwarning("Warning", "Please wait for the preview to update")
+            return
+            
         # Calculate actual image coordinates
         canvas_width = self.canvas.winfo_width()
         canvas_height = self.canvas.winfo_height()
@@ -221,15 +486,15 @@ class ImageCropTool:
         # Convert canvas coordinates to image coordinates
         crop_x1 = max(0, int((self.crop_start_x - img_x) / self.scale_factor))
         crop_y1 = max(0, int((self.crop_start_y - img_y) / self.scale_factor))
-        crop_x2 = min(self.current_image.width, int((self.crop_end_x - img_x) / self.scale_factor))
-        crop_y2 = min(self.current_image.height, int((self.crop_end_y - img_y) / self.scale_factor))
+        crop_x2 = min(self.transform.size[0], int((self.crop_end_x - img_x) / self.scale_factor))
+        crop_y2 = min(self.transform.size[1], int((self.crop_end_y - img_y) / self.scale_factor))
         
         if crop_x2 <= crop_x1 or crop_y2 <= crop_y1:
             messagebox.showwarning("Warning", "Invalid crop area")
             return
             
         # Apply crop
-        self.current_image = self.current_image.crop((crop_x1, crop_y1, crop_x2, crop_y2))
+        self.transform = self.transform.crop((crop_x1, crop_y1, crop_x2, crop_y2))
         
         # Clear crop selection
         if self.crop_rect:
@@ -240,36 +505,36 @@ class ImageCropTool:
         
     def rotate_left(self):
         """Rotate image 90 degrees counter-clockwise"""
-        self.current_image = self.current_image.rotate(90, expand=True)
+        self.transform = self.transform.transpose(Image.Transpose.ROTATE_90)
         self.update_display()
         
     def rotate_right(self):
         """Rotate image 90 degrees clockwise"""
-        self.current_image = self.current_image.rotate(-90, expand=True)
+        self.transform = self.transform.transpose(Image.Transpose.ROTATE_270)
         self.update_display()
         
     def mirror_horizontal(self):
         """Mirror image horizontally"""
-        self.current_image = self.current_image.transpose(Image.FLIP_LEFT_RIGHT)
+        self.transform = self.transform.transpose(Image.FLIP_LEFT_RIGHT)
         self.update_display()
         
     def mirror_vertical(self):
         """Mirror image vertically"""
-        self.current_image = self.current_image.transpose(Image.FLIP_TOP_BOTTOM)
+        self.transform = self.transform.transpose(Image.FLIP_TOP_BOTTOM)
         self.update_display()
         
     def rotate_by_angle(self):
         """Rotate image by specified angle"""
         try:
             angle = float(self.angle_entry.get() or 0)
-            self.current_image = self.current_image.rotate(angle, expand=True, fillcolor=(255, 255, 255, 0))
+            self.transform = self.transform.rotate(angle)
             self.update_display()
         except ValueError:
             messagebox.showerror("Error", "Please enter a valid angle")
             
     def reset_image(self):
         """Reset image to original"""
-        self.current_image = self.original_image.copy()
+        self.transform = ImageTransform(self.original_image.size)
         if self.crop_rect:
             self.canvas.delete(self.crop_rect)
             self.crop_rect = None
@@ -281,12 +546,17 @@ class ImageCropTool:
             # Get the original format
             original_format = self.original_image.format
             
+            # All edits so far, resampled once at full resolution
+            result = self.transform.apply(self.original_image, self.fillcolor)
+            
             # Save with original format
-            if original_format:
-                self.current_image.save(self.output_path, format=original_format)
+            if open_image and is_pixel_buffer(self.output_path):
+                save_image(result, self.output_path)
+            elif original_format:
+                result.save(self.output_path, format=original_format)
             else:
                 # If format is unknown, use the file extension
-                self.current_image.save(self.output_path)
+                result.save(self.output_path)
                 
             # Exit immediately without any message
             self.root.quit()
@@ -295,14 +565,19 @@ class ImageCropTool:
         except Exception as e:
             messagebox.showerror("Error", f"Failed to save image: {str(e)}")
             
+    def schedule_display(self):
+        """Update display once per frame however many resize events arrive"""
+        if not self.display_job:
+            self.display_job = self.root.after(DISPLAY_DELAY_MS, self.update_display)
+            
     def on_canvas_configure(self, event):
         """Handle canvas resize"""
-        self.update_display()
+        self.schedule_display()
         
     def on_window_resize(self, event):
         """Handle window resize"""
         if event.widget == self.root:
-            self.root.after(100, self.update_display)
+            self.schedule_display()
             
     def run(self):
         """Run the application"""
@@ -0,0 +1,138 @@
+"""
+Raw pixel buffer files for handing images between Openpix and modules
+
+A pixel buffer is an uncompressed, memory-mapped image file: a fixed
+header holding mode, size, stride and palette, followed by the rows as
+PIL stores them. Reading maps the file instead of decoding it; for L, P,
+RGBA, CMYK and I;16 images the pixels are used straight from the mapping
+without a copy. PNG and other formats are only needed at save time.
+"""
+
+import os
+import mmap
+import struct
+from PIL import Image, ImageFile
+
+PIXEL_BUFFER_EXTENSION = ".pix"
+PIXEL_BUFFER_FORMAT = "OPENPIX"
+MAGIC = b"OPXPIX01"
+
+# magic, data offset, width, height, stride, mode, palette mode, palette length
+HEADER = struct.Struct("<8sIIII16s8sI")
+DATA_ALIGNMENT = 64
+BAND_HEIGHT = 256
+
+# Modes PIL can use directly from a mapped buffer
+MAPPED_MODES = ('L', 'P', 'RGBA', 'CMYK', 'I;16', 'I;16L', 'I;16B')
+
+def is_pixel_buffer(path):
+    """Check whether path names a pixel buffer file"""
+    return os.path.splitext(path)[1].lower() == PIXEL_BUFFER_EXTENSION
+
+def get_image_bytes(image):
+    """Estimate memory PIL uses for the decoded pixels of image"""
+    # One byte per pixel even for 1-bit, two for 16-bit; all other modes,
+    # including LA and RGB, are padded to four bytes per pixel
+    if image.mode in ('1', 'L', 'P'):
+        pixel_bytes = 1
+    elif image.mode.startswith('I;16') or image.mode in ('BGR;15', 'BGR;16'):
+        pixel_bytes = 2
+    elif image.mode == 'BGR;24':
+        pixel_bytes = 3
+    else:
+        pixel_bytes = 4
+    return image.width * image.height * pixel_bytes
+
+def get_stride(image):
+    """Get number of bytes in one row of raw image data"""
+    return len(image.crop((0, 0, image.width, 1)).tobytes())
+
+def save_pixel_buffer(image, path):
+    """Write image as pixel buffer file"""
+    if isinstance(image, Image.Image):
+        image.save(path, format=PIXEL_BUFFER_FORMAT)
+        return
+
+    # Images decoded on demand are written band by band so memory stays bounded
+    with open(path, "wb") as f:
+        write_header(image, f)
+        for top in range(0, image.height, BAND_HEIGHT):
+            bottom = min(top + BAND_HEIGHT, image.height)
+            f.write(image.crop((0, top, image.width, bottom)).tobytes())
+
+def write_pixel_buffer(image, f, filename):
+    """PIL save handler writing image as pixel buffer"""
+    offset = write_header(image, f)
+    if image.width == 0 or image.height == 0:
+        return
+
+    # Rows are streamed to the file by PIL's raw encoder, the way image
+    # plugins write uncompressed data, without an intermediate copy
+    ImageFile._save(image, f, [("raw", (0, 0) + image.size, offset, (image.mode, 0, 1))])
+
+def write_header(image, f):
+    """Write header and palette of image padded to the data offset, returns the offset"""
+    palette_mode = b""
+    palette = b""
+    if image.mode in ('P', 'PA') and image.palette:
+        palette_mode = image.palette.mode.encode("ascii")
+        palette = image.palette.tobytes()
+
+    header_size = HEADER.size + len(palette)
+    offset = (header_size + DATA_ALIGNMENT - 1) // DATA_ALIGNMENT * DATA_ALIGNMENT
+
+    f.write(HEADER.pack(MAGIC, offset, image.width, image.height, get_stride(image),
+                        image.mode.encode("ascii"), palette_mode, len(palette)))
+    f.write(palette)
+    f.write(bytes(offset - header_size))
+    return offset
+
+Image.register_save(PIXEL_BUFFER_FORMAT, write_pixel_buffer)
+
+def read_header(mapped):
+    """Parse pixel buffer header, returns dict with layout information"""
+    magic, offset, width, height, stride, mode, palette_mode, palette_length = HEADER.unpack_from(mapped, 0)
+    if magic != MAGIC:
+        raise ValueError("Not an Openpix pixel buffer")
+    return {
+        'offset': offset,
+        'size': (width, height),
+        'stride': stride,
+        'mode': mode.rstrip(b"\0").decode("ascii"),
+        'palette_mode': palette_mode.rstrip(b"\0").decode("ascii"),
+        'palette': bytes(mapped[HEADER.size:HEADER.size + palette_length])
+    }
+
+def open_pixel_buffer(path):
+    """Open pixel buffer file as image backed by a memory mapping"""
+    with open(path, "rb") as f:
+        mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+    header = read_header(mapped)
+    mode = header['mode']
+    data = memoryview(mapped)[header['offset']:]
+
+    if mode in MAPPED_MODES:
+        image = Image.frombuffer(mode, header['size'], data, "raw", mode, header['stride'], 1)
+    else:
+        # PIL stores these modes padded, unpack them once
+        image = Image.frombytes(mode, header['size'], data, "raw", mode, header['stride'], 1)
+
+    if header['palette']:
+        image.putpalette(header['palette'], header['palette_mode'])
+    return image
+
+def open_image(path):
+    """Open pixel buffer or any PIL readable file, fully loaded"""
+    if is_pixel_buffer(path):
+        return open_pixel_buffer(path)
+    with Image.open(path) as image:
+        image.load()
+    return image
+
+def save_image(image, path, format=None):
+    """Save image as pixel buffer or in the format given by format or extension"""
+    if format is None and is_pixel_buffer(path):
+        save_pixel_buffer(image, path)
+    else:
+        image.save(path, format=format)
@@ -0,0 +1,118 @@
+"""
+Module metadata and in-process plugin loading for Openpix
+
+A module may export process(image) -> image. Such modules are imported
+once and called directly on the in-memory image; all other modules keep
+running as scripts with -i/-o arguments.
+
+Modules declare options as top-level constants named OPENPIX_<OPTION>,
+for example OPENPIX_PIXEL_BUFFER = True to receive -i/-o as pixel buffer
+files. They are read from the source, so declaring them never imports
+the module.
+
+Images stay in their native mode (L, P, 1, I;16 ...). A module lists the
+modes it handles in OPENPIX_MODES and gets anything else converted first;
+modules that don't declare it get RGB or RGBA as they always did.
+"""
+
+import ast
+import os
+import re
+import importlib.util
+
+OPTION_PREFIX = "OPENPIX_"
+
+# Modes handed to modules that don't declare OPENPIX_MODES
+DEFAULT_MODES = ('RGB', 'RGBA')
+
+# Modes that carry an alpha channel
+ALPHA_MODES = ('RGBA', 'LA', 'PA', 'RGBa', 'La')
+
+# Loaded plugins: module path -> (mtime, module or None)
+_plugin_cache = {}
+
+# Module metadata: module path -> (mtime, info)
+_info_cache = {}
+
+def read_module_info(module_path):
+    """Read module metadata from its source without importing it"""
+    with open(module_path, encoding="utf-8") as f:
+        tree = ast.parse(f.read(), module_path)
+
+    info = {
+        'description': ast.get_docstring(tree) or "",
+        'in_process': False
+    }
+
+    for node in tree.body:
+        if isinstance(node, ast.FunctionDef) and node.name == "process":
+            info['in_process'] = True
+        elif isinstance(node, ast.Assign) and len(node.targets) == 1:
+            target = node.targets[0]
+            if isinstance(target, ast.Name) and target.id.startswith(OPTION_PREFIX):
+                try:
+                    info[target.id[len(OPTION_PREFIX):].lower()] = ast.literal_eval(node.value)
+                except ValueError:
+                    print(f"Ignoring non-literal {target.id} in {module_path}")
+
+    return info
+
+def get_module_info(module_path):
+    """Get module metadata, cached until the file changes"""
+    mtime = os.path.getmtime(module_path)
+    cached = _info_cache.get(module_path)
+    if cached and cached[0] == mtime:
+        return cached[1]
+
+    info = read_module_info(module_path)
+    _info_cache[module_path] = (mtime, info)
+    return info
+
+def get_module_modes(module_path):
+    """Get image modes module accepts, or None if it accepts any mode"""
+    return get_module_info(module_path).get('modes', DEFAULT_MODES)
+
+def convert_for_module(image, modes):
+    """Convert image to a mode the module accepts, returns image itself if it already does"""
+    if modes is None or image.mode in modes:
+        return image
+
+    # Keep transparency when the module can take it
+    if image.mode in ALPHA_MODES or 'transparency' in image.info:
+        for mode in modes:
+            if mode in ALPHA_MODES:
+                return image.convert(mode)
+    return image.convert(modes[0])
+
+def get_plugin(module_path):
+    """Get imported module exporting process(image), or None for script-only modules"""
+    try:
+        mtime = os.path.getmtime(module_path)
+    except OSError:
+        return None
+
+    cached = _plugin_cache.get(module_path)
+    if cached and cached[0] == mtime:
+        return cached[1]
+
+    plugin = None
+    try:
+        if get_module_info(module_path)['in_process']:
+            name = "openpix_module_" + re.sub(r"\W", "_", os.path.splitext(module_path)[0])
+            spec = importlib.util.spec_from_file_location(name, module_path)
+            plugin = importlib.util.module_from_spec(spec)
+            spec.loader.exec_module(plugin)
+    except Exception as e:
+        # Broken plugin falls back to the subprocess contract, which reports the error
+        print(f"Cannot import module {module_path}: {e}")
+        plugin = None
+
+    _plugin_cache[module_path] = (mtime, plugin)
+    return plugin
+
+def run_plugin(plugin, image):
+    """Run plugin on in-memory image, returns processed image or None if nothing was produced"""
+    result = plugin.process(image)
+    if result is not None and not hasattr(result, "save"):
+        raise TypeError(f"process() returned {type(result).__name__}, expected an image")
+    return result
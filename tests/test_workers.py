@@ -0,0 +1,33 @@
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from workers import ModuleWorkerPool, run_script
+
+def write_module(path, source):
+    with open(path, "w", encoding="utf-8") as f:
+        f.write(source)
+
+def test_run_script_restores_working_directory(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    write_module("chdir.py", "import os\nos.chdir(os.path.dirname(os.getcwd()))\n")
+
+    returncode, stdout, stderr = run_script("chdir.py", [])
+    assert returncode == 0, stderr
+    assert os.getcwd() == str(tmp_path)
+
+def test_worker_runs_module_after_chdir(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    write_module("chdir.py", "import os\nos.chdir('/')\n")
+    write_module("read.py", "print(open('input.txt').read())\n")
+    write_module("input.txt", "ok")
+
+    pool = ModuleWorkerPool(size=1)
+    try:
+        assert pool.run("chdir.py", []).returncode == 0
+        result = pool.run("read.py", [])
+        assert result.returncode == 0, result.stderr
+        assert result.stdout.strip() == "ok"
+    finally:
+        pool.close()
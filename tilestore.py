@@ -0,0 +1,456 @@
+"""
+Lazily decoded, tile-backed images for Openpix
+
+Stitched panoramas and scans can be larger than RAM, or at least larger
+than PIL's decompression bomb limit. A TiledImage only reads the file
+header when opened; pixels are decoded chunk by chunk when something asks
+for them, and decoded chunks are kept in an LRU cache under a memory cap.
+
+Chunks come from:
+
+- tiled or striped TIFF files: every tile or strip is decoded on its own
+  by handing PIL a one-chunk TIFF made from the file's tags, so all
+  compressions PIL reads work
+- pixel buffer files: rows are read straight from the memory mapping
+
+TiledImage offers the parts of the PIL Image interface the viewer and the
+hand-off code use (size, mode, crop, resize, reduce, convert, save), so
+the viewer pans it through the same pyramid code as an in-memory image,
+and pixel buffer modules get it written out band by band without the
+whole image ever being decoded. Modules that need a PIL image get one
+from to_image.
+"""
+
+import io
+import mmap
+import math
+import struct
+import weakref
+import itertools
+import threading
+from collections import OrderedDict
+from PIL import Image, ImageMode, ImagePalette, TiffImagePlugin, TiffTags
+from pixelbuffer import is_pixel_buffer, read_header, save_pixel_buffer, get_image_bytes
+
+# Images with more pixels than this are opened lazily
+LAZY_PIXELS = 64 * 1024 * 1024
+
+# Memory cap for decoded chunks of one image (all its pyramid levels together)
+CHUNK_MEMORY_LIMIT = 256 * 1024 * 1024
+
+# Chunk size of pixel buffers and reduced levels
+CHUNK_SIZE = 256
+
+# Reduced levels at most this large are decoded in full into a regular image
+OVERVIEW_PIXELS = 4096 * 4096
+
+# TIFF tags a chunk needs to be decoded on its own
+CHUNK_TAGS = (258, 259, 262, 266, 277, 284, 317, 320, 338, 339, 347, 529, 530, 531, 532)
+
+# TIFF layout tags
+IMAGE_WIDTH = 256
+IMAGE_LENGTH = 257
+STRIP_OFFSETS = 273
+ROWS_PER_STRIP = 278
+STRIP_BYTE_COUNTS = 279
+PLANAR_CONFIGURATION = 284
+BITS_PER_SAMPLE = 258
+COMPRESSION = 259
+SAMPLES_PER_PIXEL = 277
+TILE_WIDTH = 322
+TILE_LENGTH = 323
+TILE_OFFSETS = 324
+TILE_BYTE_COUNTS = 325
+
+class ChunkCache:
+    """Decoded chunks of all levels of one image, least recently used dropped first"""
+    def __init__(self, limit=CHUNK_MEMORY_LIMIT):
+        self.limit = limit
+        self.chunks = OrderedDict()
+        self.memory_used = 0
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        """Get cached chunk or None"""
+        with self.lock:
+            chunk = self.chunks.get(key)
+            if chunk is not None:
+                self.chunks.move_to_end(key)
+            return chunk
+
+    def put(self, key, chunk):
+        """Cache chunk, dropping old chunks to stay under the limit"""
+        with self.lock:
+            if key in self.chunks:
+                return
+            self.chunks[key] = chunk
+            self.memory_used += get_image_bytes(chunk)
+            while self.memory_used > self.limit and len(self.chunks) > 1:
+                key, dropped = self.chunks.popitem(last=False)
+                self.memory_used -= get_image_bytes(dropped)
+
+    def evict(self, token):
+        """Drop all chunks of the image with token"""
+        with self.lock:
+            for key in [key for key in self.chunks if key[0] == token]:
+                self.memory_used -= get_image_bytes(self.chunks.pop(key))
+
+class TiffChunkSource:
+    """Tiles or strips of a TIFF file, each decoded on its own"""
+    def __init__(self, path):
+        self.path = path
+
+        # Opened through the plugin class, so PIL's decompression bomb check does not apply
+        self.file = open(path, "rb")
+        try:
+            tiff = TiffImagePlugin.TiffImageFile(self.file)
+        except Exception:
+            self.file.close()
+            raise
+        tags = tiff.tag_v2
+        self.lock = threading.Lock()
+        self.size = tiff.size
+        self.mode = tiff.mode
+        self.palette = None
+        self.info = {}
+        self.prefix = tags.prefix
+        self.chunk_tags = [(tag, tags.tagtype[tag], tags[tag]) for tag in CHUNK_TAGS if tag in tags]
+
+        # Directory length of chunk files by chunk size
+        self.directory_lengths = {}
+
+        if tags.get(PLANAR_CONFIGURATION, 1) != 1:
+            raise ValueError("Separate color planes are not supported")
+        if TILE_OFFSETS in tags:
+            self.tiled = True
+            self.chunk_size = (tags[TILE_WIDTH], tags[TILE_LENGTH])
+            self.offsets = tags[TILE_OFFSETS]
+            self.byte_counts = tags[TILE_BYTE_COUNTS]
+        else:
+            self.tiled = False
+            self.chunk_size = (self.size[0], min(tags.get(ROWS_PER_STRIP, self.size[1]), self.size[1]))
+            self.offsets = tags[STRIP_OFFSETS]
+            self.byte_counts = tags[STRIP_BYTE_COUNTS]
+
+        # Uncompressed rows can be read from anywhere, so strips (often one for the whole
+        # image) are read as square chunks instead
+        bits = tags.get(BITS_PER_SAMPLE, (1,))
+        bits = bits if isinstance(bits, tuple) else (bits,)
+        self.rows_per_strip = self.chunk_size[1]
+        self.pixel_bytes = None
+        if not self.tiled and tags.get(COMPRESSION, 1) == 1 and all(value % 8 == 0 for value in bits):
+            samples = tags.get(SAMPLES_PER_PIXEL, len(bits))
+            self.pixel_bytes = sum(bits) // 8 if len(bits) == samples else bits[0] // 8 * samples
+            self.chunk_size = (CHUNK_SIZE, CHUNK_SIZE)
+        self.columns = math.ceil(self.size[0] / self.chunk_size[0])
+
+        if self.mode in ('P', 'PA'):
+            # Color map of the file, as a decoded chunk has it
+            self.palette = self.read_chunk(0, 0).palette
+
+    def read_chunk(self, column, row):
+        """Decode one tile or strip"""
+        if self.pixel_bytes:
+            return self.read_raw_chunk(column, row)
+
+        index = row * self.columns + column
+        with self.lock:
+            self.file.seek(self.offsets[index])
+            data = self.file.read(self.byte_counts[index])
+
+        chunk_width, chunk_height = self.chunk_size
+        if not self.tiled:
+            # Last strip only holds the remaining rows
+            chunk_height = min(chunk_height, self.size[1] - row * chunk_height)
+
+        with Image.open(io.BytesIO(self.make_chunk_file(data, chunk_width, chunk_height)), formats=["TIFF"]) as chunk:
+            chunk.load()
+
+        # Edge tiles are padded to the full tile size
+        width = min(chunk_width, self.size[0] - column * chunk_width)
+        height = min(chunk_height, self.size[1] - row * self.chunk_size[1])
+        if chunk.size != (width, height):
+            chunk = chunk.crop((0, 0, width, height))
+        return chunk
+
+    def read_raw_chunk(self, column, row):
+        """Decode one square chunk of an uncompressed striped file"""
+        left = column * CHUNK_SIZE
+        top = row * CHUNK_SIZE
+        width = min(CHUNK_SIZE, self.size[0] - left)
+        height = min(CHUNK_SIZE, self.size[1] - top)
+        row_bytes = self.size[0] * self.pixel_bytes
+
+        rows = []
+        with self.lock:
+            for y in range(top, top + height):
+                strip, strip_row = divmod(y, self.rows_per_strip)
+                self.file.seek(self.offsets[strip] + strip_row * row_bytes + left * self.pixel_bytes)
+                rows.append(self.file.read(width * self.pixel_bytes))
+
+        with Image.open(io.BytesIO(self.make_chunk_file(b"".join(rows), width, height)), formats=["TIFF"]) as chunk:
+            chunk.load()
+        return chunk
+
+    def make_chunk_file(self, data, width, height):
+        """Build a TIFF file holding only one chunk of the source file"""
+        ifd = TiffImagePlugin.ImageFileDirectory_v2(prefix=self.prefix)
+        for tag, tag_type, value in self.chunk_tags:
+            ifd.tagtype[tag] = tag_type
+            ifd[tag] = value
+
+        layout = {IMAGE_WIDTH: width, IMAGE_LENGTH: height}
+        if self.tiled:
+            layout.update({TILE_WIDTH: width, TILE_LENGTH: height})
+            offsets_tag, counts_tag = TILE_OFFSETS, TILE_BYTE_COUNTS
+        else:
+            layout[ROWS_PER_STRIP] = height
+            offsets_tag, counts_tag = STRIP_OFFSETS, STRIP_BYTE_COUNTS
+        layout.update({offsets_tag: 0, counts_tag: len(data)})
+        for tag, value in layout.items():
+            ifd.tagtype[tag] = TiffTags.LONG
+            ifd[tag] = value
+
+        # Data follows the directory; PIL already points strip offsets past it, tile offsets are
+        # stored inline, so setting one does not change the directory length
+        if self.tiled:
+            if (width, height) not in self.directory_lengths:
+                self.directory_lengths[(width, height)] = len(ifd.tobytes(8))
+            ifd[offsets_tag] = 8 + self.directory_lengths[(width, height)]
+        endian = "<" if self.prefix == b"II" else ">"
+        return self.prefix + struct.pack(endian + "HI", 42, 8) + ifd.tobytes(8) + data
+
+    def close(self):
+        """Close source file"""
+        self.file.close()
+
+class PixelBufferChunkSource:
+    """Square chunks of a pixel buffer file, read from its memory mapping"""
+    def __init__(self, path):
+        self.path = path
+        with open(path, "rb") as f:
+            self.mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        header = read_header(self.mapped)
+        self.size = header['size']
+        self.mode = header['mode']
+        self.offset = header['offset']
+        self.stride = header['stride']
+        self.palette = None
+        if header['palette']:
+            self.palette = ImagePalette.ImagePalette(header['palette_mode'], header['palette'])
+        self.info = {}
+        self.chunk_size = (CHUNK_SIZE, CHUNK_SIZE)
+
+        # Bytes per pixel, rows hold whole pixels for every mode but 1-bit
+        self.pixel_bytes = self.stride // self.size[0] if self.mode != '1' and self.size[0] else None
+
+    def read_chunk(self, column, row):
+        """Copy one chunk out of the mapping"""
+        width, height = self.size
+        left = column * CHUNK_SIZE
+        top = row * CHUNK_SIZE
+        right = min(left + CHUNK_SIZE, width)
+        bottom = min(top + CHUNK_SIZE, height)
+
+        if self.pixel_bytes is None:
+            # Whole rows for bit packed images
+            rows = self.mapped[self.offset + top * self.stride:self.offset + bottom * self.stride]
+            chunk = Image.frombytes(self.mode, (width, bottom - top), rows).crop((left, 0, right, bottom - top))
+        else:
+            start = self.offset + top * self.stride + left * self.pixel_bytes
+            length = (right - left) * self.pixel_bytes
+            rows = b"".join(self.mapped[start + y * self.stride:start + y * self.stride + length]
+                            for y in range(bottom - top))
+            chunk = Image.frombytes(self.mode, (right - left, bottom - top), rows)
+
+        if self.palette:
+            chunk.putpalette(self.palette)
+        return chunk
+
+    def close(self):
+        """Unmap source file"""
+        self.mapped.close()
+
+class ConvertedChunkSource:
+    """Chunks of another tiled image passed through a function, e.g. a mode conversion"""
+    def __init__(self, parent, function):
+        self.parent = parent
+        self.function = function
+        self.size = parent.size
+        self.chunk_size = parent.chunk_size
+
+        # Result mode may depend on chunk content (palette transparency), so look at one
+        sample = function(parent.get_chunk(0, 0))
+        self.mode = sample.mode
+        self.palette = sample.palette if sample.mode in ('P', 'PA') else None
+        self.info = {}
+
+    def read_chunk(self, column, row):
+        """Convert chunk of parent"""
+        return self.function(self.parent.get_chunk(column, row))
+
+    def close(self):
+        """Nothing to close, the parent owns the file"""
+
+class ReducedChunkSource:
+    """Chunks of another tiled image at a fraction of its resolution"""
+    def __init__(self, parent, factor):
+        self.parent = parent
+        self.factor = factor
+        self.size = (max(1, parent.width // factor), max(1, parent.height // factor))
+        self.mode = parent.mode
+        self.palette = parent.palette
+        self.info = {}
+        self.chunk_size = (CHUNK_SIZE, CHUNK_SIZE)
+
+    def read_chunk(self, column, row):
+        """Reduce the parent region covered by one chunk"""
+        factor = self.factor
+        left = column * CHUNK_SIZE
+        top = row * CHUNK_SIZE
+        right = min(left + CHUNK_SIZE, self.size[0])
+        bottom = min(top + CHUNK_SIZE, self.size[1])
+        region = self.parent.crop((left * factor, top * factor, right * factor, bottom * factor))
+        return region.reduce(factor)
+
+    def close(self):
+        """Nothing to close, the parent owns the file"""
+
+# Cache keys of tiled images, unlike id() never reused by a later image
+IMAGE_TOKENS = itertools.count()
+
+class TiledImage:
+    """Image decoded chunk by chunk on demand"""
+    def __init__(self, source, cache=None):
+        self.source = source
+        self.cache = cache if cache is not None else ChunkCache()
+        self.token = next(IMAGE_TOKENS)
+
+        # Chunks of a collected image are dead weight in a shared cache
+        self.finalizer = weakref.finalize(self, self.cache.evict, self.token)
+        self.size = source.size
+        self.width, self.height = source.size
+        self.mode = source.mode
+        self.palette = source.palette
+        self.info = source.info
+        self.chunk_size = source.chunk_size
+
+    def getbands(self):
+        """Get band names, as PIL images do"""
+        return ImageMode.getmode(self.mode).bands
+
+    def load(self):
+        """Nothing to do, chunks are decoded when needed"""
+
+    def get_chunk(self, column, row):
+        """Get decoded chunk, from the cache if possible"""
+        key = (self.token, column, row)
+        chunk = self.cache.get(key)
+        if chunk is None:
+            chunk = self.source.read_chunk(column, row)
+            self.cache.put(key, chunk)
+        return chunk
+
+    def crop(self, box):
+        """Get region of the image as a regular image"""
+        left, top, right, bottom = (int(value) for value in box)
+        chunk_width, chunk_height = self.chunk_size
+        first_column, first_row = left // chunk_width, top // chunk_height
+        last_column, last_row = (right - 1) // chunk_width, (bottom - 1) // chunk_height
+
+        if first_column == last_column and first_row == last_row:
+            # Region inside one chunk, no assembly needed
+            x, y = first_column * chunk_width, first_row * chunk_height
+            return self.get_chunk(first_column, first_row).crop((left - x, top - y, right - x, bottom - y))
+
+        region = Image.new(self.mode, (right - left, bottom - top))
+        if self.palette:
+            region.putpalette(self.palette)
+        for row in range(max(0, first_row), min(last_row, (self.height - 1) // chunk_height) + 1):
+            for column in range(max(0, first_column), min(last_column, (self.width - 1) // chunk_width) + 1):
+                x, y = column * chunk_width, row * chunk_height
+                chunk = self.get_chunk(column, row)
+                part = chunk.crop((max(left - x, 0), max(top - y, 0),
+                                   min(right - x, chunk.width), min(bottom - y, chunk.height)))
+                region.paste(part, (max(x - left, 0), max(y - top, 0)))
+        return region
+
+    def resize(self, size, resample=Image.Resampling.BICUBIC, box=None):
+        """Resample part of the image, decoding only the chunks under box"""
+        if box is None:
+            box = (0, 0, self.width, self.height)
+
+        # Filters reach a few source pixels beyond the box
+        ratio = max((box[2] - box[0]) / size[0], (box[3] - box[1]) / size[1], 1.0)
+        margin = math.ceil(3 * ratio) + 1
+        left = max(0, int(box[0]) - margin)
+        top = max(0, int(box[1]) - margin)
+        right = min(self.width, math.ceil(box[2]) + margin)
+        bottom = min(self.height, math.ceil(box[3]) + margin)
+
+        region = self.crop((left, top, right, bottom))
+        return region.resize(size, resample, box=(box[0] - left, box[1] - top, box[2] - left, box[3] - top))
+
+    def reduce(self, factor):
+        """Get image reduced by integer factor, a regular image once it is small enough"""
+        reduced = TiledImage(ReducedChunkSource(self, factor), self.cache)
+        if reduced.width * reduced.height <= OVERVIEW_PIXELS:
+            return reduced.to_image()
+        return reduced
+
+    def convert(self, mode):
+        """Get lazily converted image"""
+        if mode == self.mode:
+            return self
+        return self.map(lambda chunk: chunk.convert(mode))
+
+    def map(self, function):
+        """Get image whose chunks are function applied to the chunks of this one"""
+        return TiledImage(ConvertedChunkSource(self, function), self.cache)
+
+    def get_path(self):
+        """Get path of the file chunks are read from"""
+        source = self.source
+        while hasattr(source, 'parent'):
+            source = source.parent.source
+        return source.path
+
+    def close(self):
+        """Drop cached chunks and close the source"""
+        self.finalizer()
+        self.source.close()
+
+    def to_image(self):
+        """Decode the whole image into a regular image"""
+        return self.crop((0, 0, self.width, self.height))
+
+    def copy(self):
+        """Get regular image copy"""
+        return self.to_image()
+
+    def save(self, path, format=None, **params):
+        """Save image, pixel buffers are written band by band without decoding everything"""
+        if format is None and is_pixel_buffer(path):
+            save_pixel_buffer(self, path)
+        else:
+            self.to_image().save(path, format=format, **params)
+
+def open_tiled(path, min_pixels=LAZY_PIXELS):
+    """Open large TIFF or pixel buffer file lazily, None if it is small or of another format"""
+    try:
+        if is_pixel_buffer(path):
+            source = PixelBufferChunkSource(path)
+        else:
+            with open(path, "rb") as f:
+                if f.read(4) not in (b"II*\0", b"MM\0*"):
+                    return None
+            source = TiffChunkSource(path)
+    except (OSError, ValueError, KeyError, SyntaxError) as e:
+        # Not a layout that can be read chunk by chunk, decode it the usual way
+        print(f"Cannot open {path} lazily: {e}")
+        return None
+
+    if source.size[0] * source.size[1] < min_pixels:
+        source.close()
+        return None
+    return TiledImage(source)
@@ -0,0 +1,183 @@
+"""
+Performance tracing for Openpix
+
+Code marks the phases worth timing with named spans:
+
+    with span("load.decode", path=image_path):
+        image = open_image(image_path)
+
+Spans that start and end in different callbacks (a module running in a
+worker process, a viewer frame whose tiles arrive over several polls) use
+begin/end instead. The latest duration of every span name is always
+kept, which is what the on-canvas timing HUD shows. When a trace file is
+enabled, every span is also recorded and written on exit in the Chrome
+trace event format, to be opened in chrome://tracing or ui.perfetto.dev.
+"""
+
+import os
+import sys
+import json
+import time
+import threading
+
+TRACE_DIR = os.path.join("cache", "traces")
+
+# Recorded events above this count are dropped, so a long session cannot grow without bound
+MAX_EVENTS = 200000
+
+class Tracer:
+    """Named span timings, optionally recorded as Chrome trace events"""
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.origin = time.perf_counter()
+        self.last = {}
+        self.events = None
+        self.dropped = 0
+        self.path = None
+
+    def enable_file(self, path):
+        """Record all spans from now on and write them to path on save"""
+        self.path = path
+        self.events = []
+        self.dropped = 0
+
+    def add(self, name, start, seconds, args=None):
+        """Record span that started at perf_counter time start and took seconds"""
+        with self.lock:
+            self.last[name] = seconds
+            if self.events is None:
+                return
+            if len(self.events) >= MAX_EVENTS:
+                self.dropped += 1
+                return
+            event = {
+                'name': name,
+                'cat': name.split(".", 1)[0],
+                'ph': 'X',
+                'ts': (start - self.origin) * 1e6,
+                'dur': seconds * 1e6,
+                'pid': os.getpid(),
+                'tid': threading.get_ident()
+            }
+            if args:
+                event['args'] = args
+            self.events.append(event)
+
+    def get_last(self, name):
+        """Get latest duration of span name in seconds, None if it never ran"""
+        return self.last.get(name)
+
+    def save(self):
+        """Write recorded events to the trace file, returns its path or None"""
+        if self.events is None:
+            return None
+        with self.lock:
+            events = list(self.events)
+        metadata = [{'name': 'thread_name', 'ph': 'M', 'pid': os.getpid(), 'tid': thread.ident,
+                     'args': {'name': thread.name}} for thread in threading.enumerate()]
+        try:
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            with open(self.path, "w", encoding="utf-8") as f:
+                json.dump({'traceEvents': metadata + events, 'displayTimeUnit': 'ms',
+                           'otherData': {'dropped_events': self.dropped}}, f, default=str)
+        except OSError as e:
+            print(f"Cannot write trace file: {e}")
+            return None
+        return self.path
+
+class Span:
+    """Context manager timing one span"""
+    def __init__(self, tracer, name, args):
+        self.tracer = tracer
+        self.name = name
+        self.args = args
+        self.start = None
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.end()
+        return False
+
+    def end(self):
+        """Stop timing, for spans started with begin"""
+        if self.start is not None:
+            self.tracer.add(self.name, self.start, time.perf_counter() - self.start, self.args)
+            self.start = None
+
+tracer = Tracer()
+
+def span(name, **args):
+    """Time a with block as span name"""
+    return Span(tracer, name, args)
+
+def begin(name, **args):
+    """Start span name, finished later with its end method"""
+    started = Span(tracer, name, args)
+    started.__enter__()
+    return started
+
+def get_last(name):
+    """Get latest duration of span name in seconds, None if it never ran"""
+    return tracer.get_last(name)
+
+def get_default_trace_path():
+    """Get trace file path for a session started now"""
+    return os.path.join(TRACE_DIR, time.strftime("openpix-%Y%m%d-%H%M%S.json"))
+
+def enable_trace_file(path=None):
+    """Record spans of this session and write them to path on exit, returns the path"""
+    import atexit
+    path = path or get_default_trace_path()
+    tracer.enable_file(path)
+    atexit.register(save_trace)
+    return path
+
+def save_trace():
+    """Write trace file of this session, if enabled"""
+    path = tracer.save()
+    if path:
+        print(f"Trace written to {path}")
+    return path
+
+def get_memory_usage():
+    """Get resident memory of this process in bytes, None if it cannot be read"""
+    try:
+        # Linux: current resident pages
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, AttributeError, IndexError):
+        pass
+
+    if sys.platform == "win32":
+        try:
+            import ctypes
+            from ctypes import wintypes
+
+            class ProcessMemoryCounters(ctypes.Structure):
+                _fields_ = [('cb', wintypes.DWORD), ('PageFaultCount', wintypes.DWORD),
+                            ('PeakWorkingSetSize', ctypes.c_size_t), ('WorkingSetSize', ctypes.c_size_t),
+                            ('QuotaPeakPagedPoolUsage', ctypes.c_size_t), ('QuotaPagedPoolUsage', ctypes.c_size_t),
+                            ('QuotaPeakNonPagedPoolUsage', ctypes.c_size_t), ('QuotaNonPagedPoolUsage', ctypes.c_size_t),
+                            ('PagefileUsage', ctypes.c_size_t), ('PeakPagefileUsage', ctypes.c_size_t)]
+
+            counters = ProcessMemoryCounters()
+            counters.cb = ctypes.sizeof(counters)
+            process = ctypes.windll.kernel32.GetCurrentProcess()
+            if ctypes.windll.psapi.GetProcessMemoryInfo(process, ctypes.byref(counters), counters.cb):
+                return counters.WorkingSetSize
+        except Exception:
+            pass
+        return None
+
+    try:
+        # Other Unix: peak instead of current, kilobytes on Linux but bytes on macOS
+        import resource
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak if sys.platform == "darwin" else peak * 1024
+    except (ImportError, OSError):
+        return None
@@ -0,0 +1,393 @@
+"""
+Warm worker processes for modules that run as scripts
+
+Modules without an in-process entry point still need process isolation:
+they may crash, leak or open their own Tk window. Instead of starting a
+new interpreter per click, jobs are sent over a pipe to pre-spawned
+workers that already have PIL and the module runtime imported.
+
+Jobs do not block: the caller polls them from its event loop, receives
+the module's stdout line by line while it runs, and can cancel them.
+"""
+
+import io
+import os
+import sys
+import queue
+import runpy
+import threading
+import subprocess
+import traceback
+import multiprocessing
+from contextlib import redirect_stdout, redirect_stderr
+
+# Pool configuration
+POOL_SIZE = 2
+MAX_JOBS_PER_WORKER = 20
+
+# Imported by workers up front, modules commonly use them
+PRELOAD_MODULES = ["argparse", "PIL.Image", "PIL.ImageTk", "customtkinter"]
+
+def preload_runtime():
+    """Import what modules commonly use so jobs don't pay for it"""
+    import importlib
+    for name in PRELOAD_MODULES:
+        try:
+            importlib.import_module(name)
+        except ImportError:
+            pass
+
+def get_library_dirs():
+    """Get directories of the Python installation and installed packages"""
+    import site
+    dirs = {sys.prefix, sys.base_prefix, sys.exec_prefix, site.getusersitepackages()}
+    return tuple(os.path.join(os.path.abspath(path), "") for path in dirs)
+
+LIBRARY_DIRS = get_library_dirs()
+
+def is_library_module(module):
+    """Check if module is built in or installed, such imports stay loaded between jobs"""
+    path = getattr(module, "__file__", None)
+    # Extension modules cannot be loaded twice in one process
+    return path is None or os.path.abspath(path).startswith(LIBRARY_DIRS)
+
+def get_module_environment():
+    """Get environment letting module scripts import Openpix helpers like pixelbuffer"""
+    app_dir = os.path.dirname(os.path.abspath(__file__))
+    env = dict(os.environ)
+    env['PYTHONPATH'] = os.pathsep.join(filter(None, [app_dir, env.get('PYTHONPATH')]))
+    return env
+
+def close_tk_windows():
+    """Destroy Tk root left behind by a module, returns True if there was one"""
+    tkinter = sys.modules.get("tkinter")
+    root = getattr(tkinter, "_default_root", None) if tkinter else None
+    if root is None:
+        return False
+    try:
+        root.destroy()
+    except Exception:
+        pass
+    return True
+
+class LineSender(io.StringIO):
+    """Text stream that also sends every completed line over a connection"""
+    def __init__(self, connection):
+        super().__init__()
+        self.connection = connection
+        self.pending = ""
+
+    def write(self, text):
+        self.pending += text
+        while "\n" in self.pending:
+            line, self.pending = self.pending.split("\n", 1)
+            self.connection.send(("output", line))
+        return super().write(text)
+
+def run_script(module_path, args, stdout=None):
+    """Run module script as __main__, returns (returncode, stdout, stderr)"""
+    stdout = stdout or io.StringIO()
+    stderr = io.StringIO()
+    returncode = 0
+
+    old_argv = sys.argv
+    old_path = list(sys.path)
+    old_cwd = os.getcwd()
+    old_modules = set(sys.modules)
+    sys.argv = [module_path] + list(args)
+    sys.path.insert(0, os.path.dirname(os.path.abspath(module_path)))
+    try:
+        with redirect_stdout(stdout), redirect_stderr(stderr):
+            runpy.run_path(module_path, run_name="__main__")
+    except SystemExit as e:
+        # Same mapping as the interpreter uses for sys.exit()
+        if e.code is None:
+            returncode = 0
+        elif isinstance(e.code, int):
+            returncode = e.code
+        else:
+            print(e.code, file=stderr)
+            returncode = 1
+    except BaseException:
+        traceback.print_exc(file=stderr)
+        returncode = 1
+    finally:
+        sys.argv = old_argv
+        sys.path[:] = old_path
+        # Module and hand-off paths of later jobs are relative to it
+        os.chdir(old_cwd)
+        # Helpers imported by this module must not be found by the next one
+        for name in set(sys.modules) - old_modules:
+            if not is_library_module(sys.modules[name]):
+                del sys.modules[name]
+
+    return returncode, stdout.getvalue(), stderr.getvalue()
+
+def worker_main(connection):
+    """Worker process loop: run module scripts received over connection"""
+    preload_runtime()
+
+    while True:
+        try:
+            job = connection.recv()
+        except (EOFError, OSError):
+            break
+        if job is None:
+            break
+
+        module_path, args = job
+        returncode, stdout, stderr = run_script(module_path, args, LineSender(connection))
+
+        # Tk does not survive being reused in one interpreter, recycle the worker
+        recycle = close_tk_windows()
+        connection.send(("done", returncode, stdout, stderr, recycle))
+
+class WorkerJob:
+    """Module script running in a pool worker"""
+    def __init__(self, pool, worker, cmd, module_path, args):
+        self.pool = pool
+        self.worker = worker
+        self.cmd = cmd
+        self.result = None
+        self.cancelled = False
+
+        # Cancel may come from another thread than the one waiting
+        self.lock = threading.Lock()
+        worker['connection'].send((module_path, list(args)))
+
+    @property
+    def done(self):
+        """Check if job has finished"""
+        return self.result is not None
+
+    def poll(self):
+        """Collect output lines sent since the last poll"""
+        lines = []
+        connection = self.worker['connection']
+        try:
+            while not self.done and connection.poll():
+                message = connection.recv()
+                if message[0] == "output":
+                    lines.append(message[1])
+                else:
+                    self.finish(*message[1:])
+        except (EOFError, OSError):
+            # Worker crashed, report its exit status the way subprocess does
+            self.worker['process'].join(timeout=5)
+            returncode = self.worker['process'].exitcode
+            if returncode is None:
+                returncode = 1
+            self.finish(returncode, "", f"Module worker exited with code {returncode}", True)
+        return lines
+
+    def wait(self):
+        """Block until the job is done, returns subprocess.CompletedProcess"""
+        while not self.done:
+            try:
+                self.worker['connection'].poll(None)
+            except (EOFError, OSError):
+                # Killed by cancel from another thread, poll reports it
+                pass
+            self.poll()
+        return self.result
+
+    def cancel(self):
+        """Kill the worker running the job"""
+        if self.done:
+            return
+        self.cancelled = True
+        self.worker['process'].kill()
+        self.worker['process'].join()
+        self.finish(self.worker['process'].exitcode, "", "Cancelled", True)
+
+    def finish(self, returncode, stdout, stderr, recycle):
+        """Store result and hand the worker back to the pool, once"""
+        with self.lock:
+            if self.result is not None:
+                return
+            self.result = subprocess.CompletedProcess(self.cmd, returncode, stdout, stderr)
+        self.pool.release(self.worker, recycle)
+
+class SubprocessJob:
+    """Module script running in a fresh interpreter"""
+    def __init__(self, cmd):
+        self.cmd = cmd
+        self.result = None
+        self.cancelled = False
+        self.lines = queue.Queue()
+        self.stdout = []
+        self.stderr = []
+        self.process = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+                                        text=True, env=get_module_environment())
+        self.readers = [
+            threading.Thread(target=self.read_stream, args=(self.process.stdout, self.stdout, True), daemon=True),
+            threading.Thread(target=self.read_stream, args=(self.process.stderr, self.stderr, False), daemon=True)
+        ]
+        for reader in self.readers:
+            reader.start()
+
+    @property
+    def done(self):
+        """Check if job has finished"""
+        return self.result is not None
+
+    def read_stream(self, stream, collected, forward):
+        """Collect lines of a child stream"""
+        for line in stream:
+            collected.append(line)
+            if forward:
+                self.lines.put(line.rstrip("\n"))
+
+    def poll(self):
+        """Collect output lines printed since the last poll"""
+        lines = []
+        while True:
+            try:
+                lines.append(self.lines.get_nowait())
+            except queue.Empty:
+                break
+
+        if not self.done and self.process.poll() is not None:
+            for reader in self.readers:
+                reader.join()
+            self.result = subprocess.CompletedProcess(self.cmd, self.process.returncode,
+                                                      "".join(self.stdout), "".join(self.stderr))
+        return lines
+
+    def wait(self):
+        """Block until the job is done, returns subprocess.CompletedProcess"""
+        self.process.wait()
+        self.poll()
+        return self.result
+
+    def cancel(self):
+        """Kill the child process"""
+        if self.done:
+            return
+        self.cancelled = True
+        self.process.kill()
+        self.wait()
+
+class ThreadJob:
+    """In-process function call running on a background thread
+
+    A thread cannot be killed, so cancelling only marks the job and its
+    result is ignored by the caller.
+    """
+    def __init__(self, function, *args):
+        self.value = None
+        self.error = None
+        self.cancelled = False
+        self.finished = threading.Event()
+        threading.Thread(target=self.run, args=(function, args), daemon=True).start()
+
+    @property
+    def done(self):
+        """Check if job has finished"""
+        return self.finished.is_set()
+
+    def run(self, function, args):
+        """Call function, keeping its return value or exception"""
+        try:
+            self.value = function(*args)
+        except Exception as e:
+            self.error = e
+        self.finished.set()
+
+    def poll(self):
+        """In-process jobs do not stream output"""
+        return []
+
+    def wait(self):
+        """Block until the call returns, returns its value"""
+        self.finished.wait()
+        return self.value
+
+    def cancel(self):
+        """Mark job as cancelled"""
+        self.cancelled = True
+
+class ModuleWorkerPool:
+    """Pool of pre-spawned worker processes running module scripts"""
+    def __init__(self, size=POOL_SIZE, max_jobs=MAX_JOBS_PER_WORKER):
+        self.size = size
+        self.max_jobs = max_jobs
+        self.context = multiprocessing.get_context("spawn")
+        self.idle = []
+
+        # Jobs may be started and finished from different threads
+        self.lock = threading.Lock()
+
+        for _ in range(size):
+            worker = self.spawn_worker()
+            if worker:
+                self.idle.append(worker)
+
+    def spawn_worker(self):
+        """Start a new worker process, returns None if it cannot be started"""
+        try:
+            parent_connection, child_connection = self.context.Pipe()
+            process = self.context.Process(target=worker_main, args=(child_connection,), daemon=True)
+            process.start()
+            child_connection.close()
+        except Exception as e:
+            print(f"Cannot start module worker: {e}")
+            return None
+        return {'process': process, 'connection': parent_connection, 'jobs': 0}
+
+    def acquire(self):
+        """Get an idle live worker, spawning one if needed"""
+        with self.lock:
+            while self.idle:
+                worker = self.idle.pop()
+                if worker['process'].is_alive():
+                    return worker
+                self.stop_worker(worker)
+        return self.spawn_worker()
+
+    def release(self, worker, recycle=False):
+        """Return worker to the pool, replacing it when it crashed or ran too many jobs"""
+        worker['jobs'] += 1
+        if recycle or worker['jobs'] >= self.max_jobs or not worker['process'].is_alive():
+            self.stop_worker(worker)
+            worker = self.spawn_worker()
+        if worker:
+            with self.lock:
+                self.idle.append(worker)
+
+    def stop_worker(self, worker):
+        """Stop worker process"""
+        try:
+            worker['connection'].send(None)
+        except Exception:
+            pass
+        worker['connection'].close()
+        worker['process'].join(timeout=1)
+        if worker['process'].is_alive():
+            worker['process'].kill()
+            worker['process'].join()
+
+    def start(self, module_path, args):
+        """Start module script with args, returns job to poll"""
+        cmd = [sys.executable, module_path] + list(args)
+
+        worker = self.acquire()
+        if worker is None:
+            # No worker available, fall back to a fresh interpreter
+            return SubprocessJob(cmd)
+
+        try:
+            return WorkerJob(self, worker, cmd, module_path, args)
+        except (EOFError, OSError):
+            self.release(worker, recycle=True)
+            return SubprocessJob(cmd)
+
+    def run(self, module_path, args):
+        """Run module script with args, returns subprocess.CompletedProcess like subprocess.run"""
+        return self.start(module_path, args).wait()
+
+    def close(self):
+        """Stop all idle workers"""
+        with self.lock:
+            while self.idle:
+                self.stop_worker(self.idle.pop())